@@ -24,3 +24,9 @@
 
 
 from .pydendroheatmap import *
+from .clustering import *
+from .batch import export_many
+from .chunked import reorder_matrix
+from .colormaps import get_colormap, cluster_colormap
+from .cache import RenderCache
+from .multipanel import MultiPanelHeatMap
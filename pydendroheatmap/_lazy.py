@@ -0,0 +1,47 @@
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2015 Matthew Antalek Jr
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import importlib
+
+
+class LazyModule(object):
+    """
+    Stands in for a module and only imports it (and the given submodules) the first time one of its attributes is
+    used, so that importing pydendroheatmap does not load matplotlib or scipy.
+    """
+
+    def __init__(self, name, submodules=()):
+        self.__name = name
+        self.__submodules = submodules
+        self.__module = None
+
+    def __getattr__(self, attribute):
+        if(self.__module is None):
+            module = importlib.import_module(self.__name)
+            for submodule in self.__submodules:
+                importlib.import_module(self.__name + '.' + submodule)
+            self.__module = module
+        return getattr(self.__module, attribute)
+
+    def __repr__(self):
+        return '<lazily imported module %r>' % self.__name
@@ -0,0 +1,95 @@
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2015 Matthew Antalek Jr
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import os
+import asyncio
+import weakref
+import threading
+import concurrent.futures
+
+
+#at most this many renders and exports run at a time, each on a thread of a shared pool
+max_workers = min(4, os.cpu_count() or 1)
+
+#at most this many figures are being rendered or exported at a time per event loop, later requests wait their turn
+max_figures = 4
+
+_executor = None
+_executor_lock = threading.Lock()
+#one semaphore per event loop, since asyncio primitives belong to the loop they are first used in
+_figure_slots = weakref.WeakKeyDictionary()
+
+
+def configure(workers=None, figures=None):
+    """
+    Changes the number of worker threads and of figures in progress at a time used by render_async and export_async.
+    Work already submitted finishes on the old pool.
+    """
+    global max_workers, max_figures, _executor
+    with _executor_lock:
+        if(workers is not None):
+            max_workers = workers
+            if(_executor is not None):
+                _executor.shutdown(wait=False)
+                _executor = None
+        if(figures is not None):
+            max_figures = figures
+            _figure_slots.clear()
+
+
+def executor():
+    #the shared, bounded pool the work runs on, created on first use
+    global _executor
+    with _executor_lock:
+        if(_executor is None):
+            _executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers,
+                                                              thread_name_prefix='pydendroheatmap')
+        return _executor
+
+
+def _slots():
+    loop = asyncio.get_running_loop()
+    if(loop not in _figure_slots):
+        _figure_slots[loop] = asyncio.Semaphore(max_figures)
+    return _figure_slots[loop]
+
+
+async def run(function, cancelled):
+    """
+    Runs function() on the shared pool once one of the max_figures slots is free and returns its result. If the
+    awaiting task is cancelled, cancelled (a threading.Event) is set so the work can stop at its next stage; work that
+    has not started yet is dropped.
+    """
+    async with _slots():
+        future = executor().submit(function)
+        try:
+            return await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            cancelled.set()
+            if(not future.cancel()):
+                #already running, hold on to the slot until it has stopped so the figure count stays bounded
+                stopped = asyncio.wrap_future(future)
+                await asyncio.wait([stopped])
+                if(not stopped.cancelled()):
+                    stopped.exception()
+            raise
@@ -0,0 +1,79 @@
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2015 Matthew Antalek Jr
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import time
+import inspect
+import traceback
+import concurrent.futures
+from .pydendroheatmap import DendroHeatMap, matplotlib
+
+
+
+def _init_worker():
+    #workers only ever draw to files, so never let them pick an interactive backend
+    matplotlib.use('Agg')
+
+
+def _build_heatmap(spec):
+    #constructor arguments go to __init__, anything else (title, colormap, ...) is set as an attribute afterwards
+    parameters = inspect.signature(DendroHeatMap.__init__).parameters
+    heatmap = DendroHeatMap(**dict((k, v) for k, v in spec.items() if k in parameters))
+    for attribute, value in spec.items():
+        if(attribute not in parameters):
+            setattr(heatmap, attribute, value)
+    return heatmap
+
+
+def _export_job(heatmap, filename):
+    start = time.time()
+    error = None
+    try:
+        if(isinstance(heatmap, dict)):
+            heatmap = _build_heatmap(heatmap)
+        heatmap.export(filename)
+        heatmap.resetPlot()
+    except Exception:
+        error = traceback.format_exc()
+    return {'filename':filename, 'seconds':time.time() - start, 'error':error}
+
+
+def export_many(jobs, max_workers=None):
+    """
+    Exports many heatmaps across a pool of worker processes, each drawing with the Agg backend.
+
+    jobs is an iterable of (heatmap, filename) pairs, where heatmap is either a DendroHeatMap or a dict of its
+    constructor arguments and attributes (e.g. {'heat_map_data': data, 'left_dendrogram': Z, 'title': 'A'}).
+    Returns one dict per job, in the same order, with the 'filename', the 'seconds' the job took and the 'error'
+    traceback if it failed (None otherwise). A failing job does not stop the others.
+    """
+    jobs = list(jobs)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker) as pool:
+        futures = [pool.submit(_export_job, heatmap, filename) for heatmap, filename in jobs]
+        results = []
+        for future, (heatmap, filename) in zip(futures, jobs):
+            try:
+                results.append(future.result())
+            except Exception:
+                #the job could not be sent to or run by a worker, e.g. it could not be pickled
+                results.append({'filename':filename, 'seconds':None, 'error':traceback.format_exc()})
+        return results
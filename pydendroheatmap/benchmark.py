@@ -0,0 +1,310 @@
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2015 Matthew Antalek Jr
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import subprocess
+import tempfile
+import tracemalloc
+import numpy as np
+import matplotlib
+import matplotlib.figure
+import matplotlib.backends.backend_agg
+import scipy.cluster.hierarchy as sch
+from .pydendroheatmap import _dendrogram_layout, _draw_dendrogram, _layout_cache, DendroHeatMap
+from .clustering import cluster_matrix
+
+
+def synthetic_linkage(n_leaves, seed=0):
+    """
+    Builds a random, roughly balanced (n_leaves-1) x 4 linkage matrix without computing any distances, so trees with
+    100k+ leaves can be benchmarked.
+    """
+    rng = np.random.RandomState(seed)
+    Z = np.empty((n_leaves-1, 4))
+    nodes = rng.permutation(n_leaves)
+    sizes = np.ones(2*n_leaves-1)
+    next_id = n_leaves
+    level = 0
+    while(len(nodes) > 1):
+        n_pairs = len(nodes)//2
+        a = nodes[0:2*n_pairs:2]
+        b = nodes[1:2*n_pairs:2]
+        rows = np.arange(next_id, next_id+n_pairs)
+        Z[rows-n_leaves, 0] = a
+        Z[rows-n_leaves, 1] = b
+        Z[rows-n_leaves, 2] = level + rng.uniform(0, 0.5, size=n_pairs)
+        sizes[rows] = sizes[a] + sizes[b]
+        Z[rows-n_leaves, 3] = sizes[rows]
+        nodes = np.concatenate([rows, nodes[2*n_pairs:]])
+        next_id += n_pairs
+        level += 1
+    return Z
+
+
+def _draw_time(draw, orientation):
+    figure = matplotlib.figure.Figure(figsize=[6, 6])
+    canvas = matplotlib.backends.backend_agg.FigureCanvasAgg(figure)
+    axes = figure.add_axes([0.1, 0.1, 0.8, 0.8])
+    start = time.time()
+    draw(axes, orientation)
+    canvas.draw()
+    return time.time() - start
+
+
+def dendrogram_scaling(sizes=(1000, 10000, 100000), reference_limit=20000, orientation='left'):
+    """
+    Times laying out and drawing a dendrogram with the native LineCollection renderer, and with sch.dendrogram for
+    comparison on trees up to reference_limit leaves. Returns a list of dicts, one per tree size.
+    """
+    results = []
+    for n_leaves in sizes:
+        Z = synthetic_linkage(n_leaves)
+
+        start = time.time()
+        layout = _dendrogram_layout(Z)
+        result = {'leaves':n_leaves, 'layout':time.time() - start}
+        result['native_draw'] = _draw_time(lambda axes, o: _draw_dendrogram(axes, layout, orientation=o), orientation)
+
+        if(n_leaves <= reference_limit):
+            result['scipy_draw'] = _draw_time(lambda axes, o: sch.dendrogram(Z, ax=axes, orientation=o, no_labels=True),
+                                              orientation)
+        else:
+            result['scipy_draw'] = None
+        results.append(result)
+    return results
+
+
+def _measure(function, memory=False):
+    #wall time of one call, plus the peak traced allocation of a second, traced call when memory is True
+    start = time.time()
+    function()
+    seconds = time.time() - start
+    peak = None
+    if(memory):
+        tracemalloc.start()
+        try:
+            function()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return seconds, peak
+
+
+def pipeline(sizes=(100, 1000, 10000, 100000), n_cols=200, max_cluster_rows=5000, aggregate_above=20000,
+             formats=('png', 'pdf', 'svg'), memory=True, seed=0, dtype=np.float64):
+    """
+    Times each stage of making a heatmap on random n x n_cols matrices, for every n in sizes. The stages are:
+    'cluster' (clustering.cluster_matrix, only up to max_cluster_rows rows since it needs O(n^2) memory), 'construct'
+    (the DendroHeatMap setters, with a cold layout cache), 'render_plot', 'draw' (drawing the figure with Agg) and
+    'export_<format>' for each of formats. Matrices with more than aggregate_above rows are drawn with
+    heat_map_aggregation='mean'. Returns a list of dicts with the 'rows', 'stage', 'seconds' and, when memory is True,
+    the 'peak_bytes' allocated by the stage. dtype is the type of the heat map data, e.g. numpy.float32 to measure
+    the savings of a compact type.
+    """
+    results = []
+    rng = np.random.RandomState(seed)
+    directory = tempfile.mkdtemp()
+    for n_rows in sizes:
+        data = rng.normal(size=(n_rows, n_cols)).astype(dtype, copy=False)
+
+        def record(stage, function):
+            seconds, peak = _measure(function, memory)
+            results.append({'rows':n_rows, 'stage':stage, 'seconds':seconds, 'peak_bytes':peak})
+
+        if(n_rows <= max_cluster_rows):
+            record('cluster', lambda: cluster_matrix(data))
+        row_Z = synthetic_linkage(n_rows, seed)
+        col_Z = synthetic_linkage(n_cols, seed)
+        aggregation = 'mean' if n_rows > aggregate_above else None
+
+        def construct():
+            _layout_cache.clear()
+            return DendroHeatMap(heat_map_data=data, left_dendrogram=row_Z, top_dendrogram=col_Z,
+                                 heat_map_aggregation=aggregation)
+        record('construct', construct)
+
+        heatmap = construct()
+
+        def render():
+            heatmap.resetPlot()
+            heatmap.render_plot(dpi=heatmap.exportDPI)
+        record('render_plot', render)
+        record('draw', lambda: heatmap.figure.canvas.draw())
+
+        for extension in formats:
+            filename = os.path.join(directory, 'benchmark.%s' % extension)
+            record('export_%s' % extension, lambda: heatmap.export(filename))
+        heatmap.resetPlot()
+    return results
+
+
+def compare(results, baseline, tolerance=1.5, min_seconds=0.05):
+    """
+    Returns the results that are more than tolerance times slower than the same stage and size in baseline (a
+    previous pipeline() result), ignoring stages that take less than min_seconds in both.
+    """
+    previous = dict(((r['rows'], r['stage']), r) for r in baseline)
+    regressions = []
+    for result in results:
+        before = previous.get((result['rows'], result['stage']))
+        if(before is None or max(before['seconds'], result['seconds']) < min_seconds):
+            continue
+        if(result['seconds'] > tolerance*before['seconds']):
+            regressions.append(dict(result, baseline_seconds=before['seconds']))
+    return regressions
+
+
+_import_probe = '''
+import sys, time, json
+start = time.perf_counter()
+import pydendroheatmap
+seconds = time.perf_counter() - start
+import numpy
+pydendroheatmap.DendroHeatMap(heat_map_data=numpy.zeros((2, 2)))
+heavy = sorted(m for m in sys.modules if m.split('.')[0] in ('matplotlib', 'scipy'))
+print(json.dumps({'seconds':seconds, 'heavy_modules':heavy}))
+'''
+
+
+def import_time(repeat=5):
+    """
+    Imports pydendroheatmap in fresh interpreters and constructs a DendroHeatMap. Returns the fastest import time in
+    seconds, and the matplotlib/scipy modules that were loaded along the way (there should be none: they are only
+    imported once something is rendered or clustered).
+    """
+    package_parent = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    environment = dict(os.environ)
+    environment['PYTHONPATH'] = os.pathsep.join([package_parent] + [p for p in [environment.get('PYTHONPATH')] if p])
+    timings = []
+    heavy_modules = []
+    for i in range(repeat):
+        output = subprocess.check_output([sys.executable, '-c', _import_probe], env=environment)
+        probe = json.loads(output.decode().strip().splitlines()[-1])
+        timings.append(probe['seconds'])
+        heavy_modules = probe['heavy_modules']
+    return min(timings), heavy_modules
+
+
+def check_import(repeat=5, max_seconds=None, baseline=None, tolerance=1.5):
+    """
+    The quick startup check: times importing pydendroheatmap (see import_time) and returns 1 if that loaded matplotlib
+    or scipy, took longer than max_seconds, or took more than tolerance times the import stage of baseline (a
+    previous pipeline() result); 0 otherwise.
+    """
+    seconds, heavy_modules = import_time(repeat)
+    print('import: %.3fs' % seconds)
+    return _check_import(seconds, heavy_modules, max_seconds, baseline, tolerance)
+
+
+def _check_import(seconds, heavy_modules, max_seconds=None, baseline=None, tolerance=1.5):
+    status = 0
+    if(heavy_modules):
+        print('REGRESSION: importing pydendroheatmap and constructing a DendroHeatMap loaded %s'
+              % ', '.join(heavy_modules))
+        status = 1
+    if(max_seconds is not None and seconds > max_seconds):
+        print('REGRESSION: importing pydendroheatmap took %.3fs, more than %.3fs' % (seconds, max_seconds))
+        status = 1
+    if(baseline is not None):
+        #min_seconds=0, the import is always well under the pipeline's noise floor
+        for result in compare([{'rows':0, 'stage':'import', 'seconds':seconds}], baseline, tolerance, min_seconds=0):
+            print('REGRESSION: importing pydendroheatmap took %.3fs, was %.3fs' % (seconds, result['baseline_seconds']))
+            status = 1
+    return status
+
+
+def _metadata(n_cols):
+    import scipy
+    return {'python':platform.python_version(), 'platform':platform.platform(), 'numpy':np.__version__,
+            'scipy':scipy.__version__, 'matplotlib':matplotlib.__version__, 'backend':matplotlib.get_backend(),
+            'columns':n_cols, 'time':time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the pydendroheatmap pipeline.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000, 100000], help='numbers of rows')
+    parser.add_argument('--columns', type=int, default=200, help='number of columns')
+    parser.add_argument('--formats', nargs='+', default=['png', 'pdf', 'svg'], help='export formats to time')
+    parser.add_argument('--dtype', default='float64', help='type of the heat map data, e.g. float32')
+    parser.add_argument('--no-memory', action='store_true', help='skip the (slower) traced runs for peak memory')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='a previous --output file to compare against')
+    parser.add_argument('--tolerance', type=float, default=1.5, help='slowdown factor that counts as a regression')
+    parser.add_argument('--dendrograms', action='store_true', help='also time dendrogram drawing against scipy')
+    parser.add_argument('--import-only', action='store_true',
+                        help='only check the import: its time, and that it does not load matplotlib or scipy')
+    parser.add_argument('--max-import-seconds', type=float, help='import time that counts as a regression')
+    args = parser.parse_args(argv)
+
+    baseline = None
+    if(args.baseline):
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)['results']
+    if(args.import_only):
+        return check_import(max_seconds=args.max_import_seconds, baseline=baseline, tolerance=args.tolerance)
+    matplotlib.use('Agg')
+    seconds, heavy_modules = import_time()
+    results = [{'rows':0, 'stage':'import', 'seconds':seconds, 'peak_bytes':None}]
+    results += pipeline(sizes=args.sizes, n_cols=args.columns, formats=args.formats, memory=not args.no_memory,
+                        dtype=np.dtype(args.dtype))
+
+    print('%10s %14s %10s %12s' % ('rows', 'stage', 'seconds', 'peak MB'))
+    for result in results:
+        peak = '-' if result['peak_bytes'] is None else '%12.1f' % (result['peak_bytes']/2.0**20)
+        print('%10d %14s %10.3f %12s' % (result['rows'], result['stage'], result['seconds'], peak))
+
+    if(args.dendrograms):
+        run()
+
+    if(args.output):
+        with open(args.output, 'w') as f:
+            json.dump({'metadata':_metadata(args.columns), 'results':results}, f, indent=1)
+
+    if(baseline is not None):
+        #the import stage is among the results, so it is compared here
+        regressions = compare(results, baseline, tolerance=args.tolerance)
+        for result in regressions:
+            print('REGRESSION: %s with %d rows took %.3fs, was %.3fs' % (result['stage'], result['rows'],
+                                                                       result['seconds'], result['baseline_seconds']))
+        if(regressions):
+            return 1
+
+    return _check_import(seconds, heavy_modules, args.max_import_seconds)
+
+
+def run():
+    print('Dendrogram render time (seconds)')
+    print('%10s %10s %12s %12s' % ('leaves', 'layout', 'native draw', 'scipy draw'))
+    for result in dendrogram_scaling():
+        scipy_draw = '-' if result['scipy_draw'] is None else '%12.3f' % result['scipy_draw']
+        print('%10d %10.3f %12.3f %12s' % (result['leaves'], result['layout'], result['native_draw'], scipy_draw))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
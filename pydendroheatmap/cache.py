@@ -0,0 +1,129 @@
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2015 Matthew Antalek Jr
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import os
+import shutil
+import tempfile
+
+
+class RenderCache(object):
+    """
+    On-disk cache of exported plots, one file per spec hash (see DendroHeatMap.spec_hash) and file format. Whenever a
+    file is stored and the files in directory add up to more than max_bytes, the least recently used ones are deleted.
+    Several processes may share one directory, since files are written under a temporary name and then renamed into
+    place.
+
+        heatmap.render_cache = RenderCache('/tmp/heatmaps', max_bytes=2**30)
+        heatmap.export('plot.png') #skips rendering when an identical plot was exported before
+    """
+
+    def __init__(self, directory, max_bytes=2**30):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        #counts for this process only, the entries on disk may be shared
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key, extension):
+        return os.path.join(self.directory, '%s.%s' % (key, extension.lower()))
+
+    def fetch(self, key, extension, filename):
+        """
+        Copies the cached file for key and extension to filename and returns True, or returns False if there is none.
+        """
+        path = self.path(key, extension)
+        try:
+            shutil.copyfile(path, filename)
+            #the modification time doubles as the last use, for eviction
+            os.utime(path)
+        except FileNotFoundError:
+            self.misses += 1
+            return False
+        self.hits += 1
+        return True
+
+    def store(self, key, extension, filename):
+        """
+        Adds a copy of filename to the cache under key and extension, then evicts the least recently used files if the
+        cache has grown past max_bytes.
+        """
+        handle, temporary = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+        os.close(handle)
+        try:
+            shutil.copyfile(filename, temporary)
+            os.replace(temporary, self.path(key, extension))
+        except BaseException:
+            os.remove(temporary)
+            raise
+        self.stores += 1
+        self.evict()
+
+    def entries(self):
+        #(path, bytes, last use) of every cached file, oldest first
+        entries = []
+        for name in os.listdir(self.directory):
+            if(name.endswith('.tmp')):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                continue
+            entries.append((os.path.join(self.directory, name), stat.st_size, stat.st_mtime))
+        return sorted(entries, key=lambda entry: entry[2])
+
+    def evict(self, max_bytes=None):
+        """
+        Deletes the least recently used files until the cache holds at most max_bytes (default self.max_bytes).
+        Returns how many files were deleted.
+        """
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        entries = self.entries()
+        total = sum(size for path, size, used in entries)
+        removed = 0
+        for path, size, used in entries:
+            if(total <= max_bytes):
+                break
+            try:
+                os.remove(path)
+                removed += 1
+            except FileNotFoundError:
+                #another process got to it first
+                pass
+            total -= size
+        self.evictions += removed
+        return removed
+
+    def clear(self):
+        return self.evict(0)
+
+    def stats(self):
+        """
+        Returns a dict with the 'hits', 'misses', 'stores' and 'evictions' of this process, and the number of
+        'entries' and 'bytes' in the cache directory along with its 'max_bytes'.
+        """
+        entries = self.entries()
+        return {'hits':self.hits, 'misses':self.misses, 'stores':self.stores, 'evictions':self.evictions,
+                'entries':len(entries), 'bytes':sum(size for path, size, used in entries), 'max_bytes':self.max_bytes}
@@ -0,0 +1,227 @@
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2015 Matthew Antalek Jr
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import numpy as np
+
+
+#roughly how many bytes of a matrix are read into memory at a time
+_chunk_bytes = 2**26
+
+
+def is_in_memory(data):
+    #plain ndarrays and matrices can be handed to numpy and matplotlib as they are, everything else is read in chunks
+    return isinstance(data, np.ndarray) and not isinstance(data, np.memmap)
+
+
+def is_array_like(data):
+    #numpy arrays and memmaps, and anything indexable that looks like a 2d array, e.g. h5py datasets or zarr arrays
+    if(isinstance(data, np.ndarray)):
+        return True
+    shape = getattr(data, 'shape', None)
+    return shape is not None and len(shape) == 2 and hasattr(data, 'dtype') and hasattr(data, '__getitem__')
+
+
+def chunk_rows(data, chunk_bytes=None):
+    """
+    Returns how many rows of data to read at a time, keeping to about chunk_bytes and to whole storage chunks for
+    arrays that are stored in chunks (h5py datasets, zarr arrays).
+    """
+    row_bytes = max(1, data.shape[1]*np.dtype(data.dtype).itemsize)
+    rows = max(1, int((chunk_bytes or _chunk_bytes)//row_bytes))
+    storage_chunks = getattr(data, 'chunks', None)
+    if(isinstance(storage_chunks, tuple) and storage_chunks and storage_chunks[0]):
+        rows = max(storage_chunks[0], rows - rows % storage_chunks[0])
+    return rows
+
+
+def iter_row_chunks(data, rows=None):
+    #yields (start, in-memory block of rows) pairs covering data
+    rows = rows or chunk_rows(data)
+    for start in range(0, data.shape[0], rows):
+        yield start, np.asarray(data[start:start+rows])
+
+
+def min_max(data, transform=None):
+    """
+    Returns the minimum and maximum of data, reading it one chunk of rows at a time when it is not in memory or when
+    transform(block, rows) is to be applied to each block of rows first.
+    """
+    if(transform is None and is_in_memory(data)):
+        return data.min(), data.max()
+    lowest = None
+    highest = None
+    for start, block in iter_row_chunks(data):
+        if(transform is not None):
+            block = transform(block, slice(start, start + len(block)))
+        block_min = block.min()
+        block_max = block.max()
+        lowest = block_min if lowest is None else min(lowest, block_min)
+        highest = block_max if highest is None else max(highest, block_max)
+    return lowest, highest
+
+
+def take_rows(data, rows):
+    """
+    Returns data[rows] as an in-memory array. Rows are read in increasing order, which h5py datasets require.
+    """
+    rows = np.asarray(rows)
+    if(isinstance(data, np.ndarray)):
+        return np.asarray(data[rows])
+    order = np.argsort(rows)
+    if(hasattr(data, 'oindex')):
+        block = np.asarray(data.oindex[rows[order], :])
+    else:
+        block = np.asarray(data[rows[order]])
+    taken = np.empty_like(block)
+    taken[order] = block
+    return taken
+
+
+def reorder_matrix(data, row_order, col_order, out=None):
+    """
+    Returns data with its rows and columns permuted by row_order and col_order (e.g. dendrogram leaf orders). The
+    rows are gathered one chunk at a time straight into out, which may be an np.memmap, so matrices larger than memory
+    can be reordered without ever holding a full copy. out defaults to an in-memory array of data's dtype, and giving
+    out a smaller dtype (e.g. numpy.float32) converts each chunk as it is copied.
+
+    out may also be data itself (an ndarray or np.memmap) when row_order and col_order are permutations, which
+    reorders data in place.
+    """
+    row_order = np.asarray(row_order)
+    col_order = np.asarray(col_order)
+    if(out is None):
+        out = np.empty((len(row_order), len(col_order)), dtype=data.dtype)
+    if(out.shape != (len(row_order), len(col_order))):
+        raise ValueError('out must have shape %r, got %r' % ((len(row_order), len(col_order)), out.shape))
+    if(out is data):
+        return _permute_in_place(data, row_order, col_order)
+
+    rows = chunk_rows(data)
+    for start in range(0, len(row_order), rows):
+        if(isinstance(data, np.ndarray)):
+            #one gather per chunk rather than a copy of the rows and then another of their columns
+            out[start:start+rows] = data[np.ix_(row_order[start:start+rows], col_order)]
+        else:
+            out[start:start+rows] = take_rows(data, row_order[start:start+rows])[:, col_order]
+    return out
+
+
+def _permute_in_place(data, row_order, col_order):
+    #reorder_matrix for out=data: rows are moved along the cycles of row_order using a single spare row, and the
+    #columns are permuted one chunk of rows at a time
+    if(not isinstance(data, np.ndarray)):
+        raise TypeError('Only ndarrays and np.memmaps can be reordered in place')
+    for order in (row_order, col_order):
+        if(not np.array_equal(np.sort(order), np.arange(len(order)))):
+            raise ValueError('Reordering in place needs row_order and col_order to be permutations')
+
+    done = row_order == np.arange(len(row_order))
+    for first in np.flatnonzero(~done):
+        if(done[first]):
+            continue
+        spare = data[first].copy()
+        position = first
+        while(row_order[position] != first):
+            data[position] = data[row_order[position]]
+            done[position] = True
+            position = row_order[position]
+        data[position] = spare
+        done[position] = True
+
+    if(np.any(col_order != np.arange(len(col_order)))):
+        rows = chunk_rows(data)
+        for start in range(0, data.shape[0], rows):
+            data[start:start+rows] = data[start:start+rows][:, col_order]
+    return data
+
+
+def take_stacked_rows(top, bottom, order, out=None):
+    """
+    Returns np.concatenate([top, bottom])[order], i.e. row i is top[order[i]] or, for order[i] >= len(top),
+    bottom[order[i] - len(top)], without making the concatenated copy. The rows are gathered one chunk at a time into
+    out, which defaults to an in-memory array of top's dtype.
+    """
+    order = np.asarray(order)
+    if(out is None):
+        out = np.empty((len(order), top.shape[1]), dtype=top.dtype)
+    n_top = top.shape[0]
+    rows = chunk_rows(out)
+    for start in range(0, len(order), rows):
+        these = order[start:start+rows]
+        from_top = these < n_top
+        block = out[start:start+rows]
+        block[from_top] = take_rows(top, these[from_top])
+        block[~from_top] = take_rows(bottom, these[~from_top] - n_top)
+    return out
+
+
+def sample_values(data, n_values, transform=None, seed=0):
+    """
+    Returns a flat sample of about n_values values of data, all of them if data is no bigger than that. The sample is
+    made of whole, randomly chosen rows (read in chunks), thinned to random columns for very wide matrices.
+    transform(block, rows) is applied to each block of rows before sampling.
+    """
+    rows, cols = data.shape
+    rng = np.random.RandomState(seed)
+    if(rows*cols <= n_values):
+        picked_rows = np.arange(rows)
+    else:
+        picked_rows = np.sort(rng.choice(rows, size=max(1, min(rows, n_values//max(cols, 1))), replace=False))
+    picked_cols = None
+    if(len(picked_rows)*cols > n_values):
+        picked_cols = np.sort(rng.choice(cols, size=max(1, n_values//len(picked_rows)), replace=False))
+
+    step = chunk_rows(data)
+    sample = []
+    for start in range(0, len(picked_rows), step):
+        these_rows = picked_rows[start:start+step]
+        block = take_rows(data, these_rows)
+        if(transform is not None):
+            block = transform(block, these_rows)
+        if(picked_cols is not None):
+            block = block[:, picked_cols]
+        sample.append(np.asarray(block).ravel())
+    return np.concatenate(sample)
+
+
+def moments(data, axis):
+    """
+    Returns the mean and standard deviation of each row (axis=1) or column (axis=0) of data, in one pass over chunks
+    of rows.
+    """
+    if(axis == 1):
+        means = np.empty(data.shape[0])
+        stds = np.empty(data.shape[0])
+        for start, block in iter_row_chunks(data):
+            means[start:start+len(block)] = block.mean(axis=1, dtype=np.float64)
+            stds[start:start+len(block)] = block.std(axis=1, dtype=np.float64)
+        return means, stds
+
+    sums = np.zeros(data.shape[1])
+    squares = np.zeros(data.shape[1])
+    for start, block in iter_row_chunks(data):
+        block = np.asarray(block, dtype=np.float64)
+        sums += block.sum(axis=0)
+        squares += (block*block).sum(axis=0)
+    means = sums/data.shape[0]
+    return means, np.sqrt(np.maximum(squares/data.shape[0] - means*means, 0))
@@ -0,0 +1,491 @@
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2015 Matthew Antalek Jr
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import os
+import collections
+import threading
+import concurrent.futures
+import numpy as np
+from ._lazy import LazyModule
+from .chunked import chunk_rows, take_rows
+
+#scipy is only imported once something is clustered
+sch = LazyModule('scipy.cluster.hierarchy')
+ssd = LazyModule('scipy.spatial.distance')
+
+
+
+#below this many rows a single pdist call is faster than splitting the work up
+_parallel_pdist_rows = 2000
+
+
+def _condensed_offset(n, i):
+    #position of the pair (i, i+1) in a condensed distance matrix of n observations
+    return n*i - i*(i+1)//2
+
+
+def _fill_condensed(out, data, start, stop, metric):
+    #distances from rows start..stop-1 to every later row, copied into their slots of the condensed matrix
+    n = data.shape[0]
+    block = ssd.cdist(data[start:stop], data[start+1:], metric)
+    for i in range(start, stop):
+        offset = _condensed_offset(n, i)
+        out[offset:offset + n-1-i] = block[i-start, i-start:]
+
+
+def _row_blocks(n, n_blocks):
+    #splits rows 0..n-2 into blocks holding roughly the same number of pairs, since row i pairs with n-1-i rows
+    pairs_before = np.cumsum(np.arange(n-1, 0, -1))
+    targets = np.linspace(0, pairs_before[-1], n_blocks+1)[1:-1]
+    edges = np.unique(np.concatenate([[0], np.searchsorted(pairs_before, targets) + 1, [n-1]]))
+    return list(zip(edges[:-1], edges[1:]))
+
+
+def condensed_distances(data, metric='euclidean', n_threads=1):
+    """
+    Returns the condensed pairwise distances between the rows of data, as scipy.spatial.distance.pdist does. With
+    n_threads > 1 on tall matrices, blocks of rows are computed concurrently and written straight into the condensed
+    result, so no square matrix is ever built.
+    """
+    data = np.asarray(data)
+    n = data.shape[0]
+    if(n_threads <= 1 or n < _parallel_pdist_rows):
+        return ssd.pdist(data, metric)
+
+    data = np.ascontiguousarray(data, dtype=np.float64)
+    out = np.empty(n*(n-1)//2)
+    #several blocks per thread keeps each cdist block small and the threads evenly loaded
+    blocks = _row_blocks(n, 4*n_threads)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=n_threads) as pool:
+        for future in [pool.submit(_fill_condensed, out, data, start, stop, metric) for start, stop in blocks]:
+            future.result()
+    return out
+
+
+def linkage_matrix(data, metric='euclidean', method='single', n_threads=1):
+    """
+    Clusters the rows of data and returns the (n-1) x 4 linkage matrix. The pairwise distances are only ever held in
+    condensed form (n*(n-1)/2 values), never as a square n x n matrix.
+    """
+    data = np.asarray(data)
+    if(data.shape[0] < 2):
+        raise ValueError('At least two observations are needed to cluster, got %d' % data.shape[0])
+    distances = condensed_distances(data, metric, n_threads=n_threads)
+    return sch.linkage(distances, method=method)
+
+
+def cluster_matrix(data, metric='euclidean', method='single', executor='thread', max_workers=None):
+    """
+    Clusters the rows and the columns of data at the same time and returns (row_linkage, col_linkage).
+
+    executor is 'thread' or 'process' to choose the kind of pool the two axes run in, or None to run them one after
+    the other. max_workers (default: the number of cpus) is shared between the axes; each axis splits its share
+    across threads when computing distances for tall matrices.
+    """
+    data = np.asarray(data)
+    if(data.ndim != 2):
+        raise ValueError('Data to cluster must be two dimensional, got %d dimension(s)' % data.ndim)
+    if(max_workers is None):
+        max_workers = os.cpu_count() or 1
+
+    if(executor is None):
+        return (linkage_matrix(data, metric, method, n_threads=max_workers),
+                linkage_matrix(data.T, metric, method, n_threads=max_workers))
+
+    if(executor == 'thread'):
+        pool = concurrent.futures.ThreadPoolExecutor(max_workers=2)
+    elif(executor == 'process'):
+        pool = concurrent.futures.ProcessPoolExecutor(max_workers=2)
+    else:
+        raise ValueError("executor must be 'thread', 'process' or None, got %r" % (executor,))
+
+    n_threads = max(1, max_workers//2)
+    with pool:
+        rows = pool.submit(linkage_matrix, data, metric, method, n_threads)
+        cols = pool.submit(linkage_matrix, np.ascontiguousarray(data.T), metric, method, n_threads)
+        return rows.result(), cols.result()
+
+
+#how many row-to-centroid distances are computed at a time
+_chunk_distances = 2**22
+
+
+def _nearest_centroids(block, centroids, metric):
+    #index of the nearest centroid to each row of block, in pieces small enough for the rows x centroids distances
+    nearest = np.empty(block.shape[0], dtype=int)
+    step = max(1, _chunk_distances//max(1, len(centroids)))
+    if(metric in ('euclidean', 'sqeuclidean')):
+        centroid_norms = (centroids*centroids).sum(axis=1)
+    for start in range(0, block.shape[0], step):
+        piece = np.asarray(block[start:start+step], dtype=np.float64)
+        if(metric in ('euclidean', 'sqeuclidean')):
+            #the nearest by squared distance, through one matrix product instead of cdist
+            distances = centroid_norms - 2*piece.dot(centroids.T)
+        else:
+            distances = ssd.cdist(piece, centroids, metric)
+        nearest[start:start+step] = np.argmin(distances, axis=1)
+    return nearest
+
+
+def _initial_centroids(data, n_clusters, metric, rng):
+    #k-means++ seeding on a random sample of rows: each next centroid is drawn with probability proportional to the
+    #squared distance to the nearest centroid so far
+    n = data.shape[0]
+    sample = np.asarray(take_rows(data, np.sort(rng.choice(n, min(n, 3*n_clusters), replace=False))), dtype=np.float64)
+    chosen = [rng.randint(len(sample))]
+    nearest = ssd.cdist(sample, sample[chosen], metric)[:,0]**2
+    for i in range(1, n_clusters):
+        total = nearest.sum()
+        if(total <= 0):
+            #fewer distinct rows than clusters, the rest would duplicate a centroid
+            break
+        chosen.append(rng.choice(len(sample), p=nearest/total))
+        nearest = np.minimum(nearest, ssd.cdist(sample, sample[chosen[-1:]], metric)[:,0]**2)
+    return sample[chosen]
+
+
+def _assign_chunk(data, start, stop, centroids, metric):
+    #the nearest centroid of rows start..stop-1, and the sum and number of the rows assigned to each centroid
+    block = np.asarray(data[start:stop])
+    nearest = _nearest_centroids(block, centroids, metric)
+    order = np.argsort(nearest, kind='stable')
+    present, starts = np.unique(nearest[order], return_index=True)
+    sums = np.zeros(centroids.shape)
+    sums[present] = np.add.reduceat(block[order], starts, axis=0, dtype=np.float64)
+    return nearest, sums, np.bincount(nearest, minlength=len(centroids))
+
+
+def minibatch_kmeans(data, n_clusters, metric='euclidean', batch_size=1024, n_iter=100, seed=0, n_threads=None):
+    """
+    Groups the rows of data into at most n_clusters clusters with mini-batch k-means: starting from rows picked by
+    k-means++ (from a random sample), each of n_iter iterations moves the centroids towards a random batch of batch_size rows. Every row is then
+    assigned to its nearest centroid (by metric) and the centroids become the means of their rows; clusters left
+    without rows are dropped. Returns (centroids, labels).
+
+    data may be an np.memmap or a chunked array such as an h5py dataset: it is only ever read in batches and chunks of
+    rows, so memory stays bounded by the centroids and the labels. The final assignment runs chunks on n_threads
+    threads (default: the number of cpus).
+    """
+    n = data.shape[0]
+    rng = np.random.RandomState(seed)
+    centroids = _initial_centroids(data, min(n_clusters, n), metric, rng)
+    n_clusters = len(centroids)
+    counts = np.zeros(n_clusters)
+    for iteration in range(n_iter):
+        batch = np.asarray(take_rows(data, np.sort(rng.choice(n, min(batch_size, n), replace=False))), dtype=np.float64)
+        nearest = _nearest_centroids(batch, centroids, metric)
+        batch_counts = np.bincount(nearest, minlength=n_clusters)
+        batch_sums = np.zeros(centroids.shape)
+        np.add.at(batch_sums, nearest, batch)
+        #each centroid moves by a step that shrinks with the number of rows it has seen so far
+        moved = batch_counts > 0
+        counts[moved] += batch_counts[moved]
+        rate = (batch_counts[moved]/counts[moved])[:, None]
+        centroids[moved] += rate*(batch_sums[moved]/batch_counts[moved, None] - centroids[moved])
+
+    labels = np.empty(n, dtype=int)
+    sums = np.zeros(centroids.shape)
+    counts = np.zeros(n_clusters, dtype=int)
+    n_threads = n_threads or os.cpu_count() or 1
+    starts = list(range(0, n, chunk_rows(data)))
+    stops = starts[1:] + [n]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=n_threads) as pool:
+        #one chunk per thread at a time, so no more than n_threads chunks are ever in memory
+        for first in range(0, len(starts), n_threads):
+            futures = [pool.submit(_assign_chunk, data, start, stop, centroids, metric)
+                       for start, stop in zip(starts[first:first+n_threads], stops[first:first+n_threads])]
+            for start, future in zip(starts[first:], futures):
+                nearest, chunk_sums, chunk_counts = future.result()
+                labels[start:start+len(nearest)] = nearest
+                sums += chunk_sums
+                counts += chunk_counts
+
+    kept = np.flatnonzero(counts)
+    renumber = np.zeros(n_clusters, dtype=int)
+    renumber[kept] = np.arange(len(kept))
+    return sums[kept]/counts[kept, None], renumber[labels]
+
+
+def two_stage_linkage(data, n_clusters=1000, metric='euclidean', method='average', batch_size=1024, n_iter=100,
+                      seed=0, n_threads=None):
+    """
+    Clusters the rows of data in two stages, for matrices with too many rows for linkage_matrix (whose pairwise
+    distances take O(n^2) memory): minibatch_kmeans groups the rows into at most n_clusters clusters, which are then
+    clustered by their centroids with metric and method. Returns (linkage, labels, centroids), where the leaves of
+    linkage are the clusters, labels is the cluster of each row and centroids the mean row of each cluster.
+    """
+    centroids, labels = minibatch_kmeans(data, n_clusters, metric, batch_size, n_iter, seed, n_threads)
+    if(len(centroids) < 2):
+        raise ValueError('At least two clusters are needed to build a tree, got %d' % len(centroids))
+    return linkage_matrix(centroids, metric, method, n_threads=n_threads or os.cpu_count() or 1), labels, centroids
+
+
+def expand_leaves(leaves, labels):
+    """
+    Returns the order of the rows whose clusters are given by labels, grouped by cluster with the clusters in the
+    order of leaves (e.g. the leaf order of two_stage_linkage's tree), and the number of rows in each cluster.
+    """
+    rank = np.empty(len(leaves), dtype=int)
+    rank[leaves] = np.arange(len(leaves))
+    return np.argsort(rank[labels], kind='stable'), np.bincount(labels, minlength=len(leaves))
+
+
+def insert_leaf(linkage, neighbour, distance):
+    """
+    Returns a copy of linkage with one more leaf (numbered n, after the existing n leaves) placed next to the
+    observation neighbour at the given distance, without reclustering. The new leaf is merged with the largest
+    cluster holding neighbour that was formed below distance, so the merge heights stay monotonic and the order of
+    the existing leaves is unchanged. Internal node ids after the inserted merge shift up by one.
+    """
+    Z = np.asarray(linkage, dtype=float)
+    n = Z.shape[0] + 1
+    children = Z[:,:2].astype(int)
+    parent = np.empty(2*n - 1, dtype=int)
+    parent[children[:,0]] = parent[children[:,1]] = np.arange(n, 2*n - 1)
+    root = 2*n - 2
+
+    #climb from the neighbour while the merge above it is still lower than the new leaf
+    node = int(neighbour)
+    while(node != root and Z[parent[node] - n, 2] < distance):
+        node = parent[node]
+    size = 1 if node < n else Z[node - n, 3]
+
+    #the new merge goes in among the merges of the same height, somewhere after the merge forming the cluster it
+    #joins and before the merge that cluster is joined by (or last, as the new root)
+    lowest = 0 if node < n else node - n + 1
+    highest = n - 1 if node == root else parent[node] - n
+    row = int(np.clip(np.searchsorted(Z[:,2], distance, side='right'), lowest, highest))
+    remapped = np.where(children < n, children, np.where(children - n < row, children + 1, children + 2))
+    out = np.empty((n, 4))
+    out[:row,:2] = remapped[:row]
+    out[row+1:,:2] = remapped[row:]
+    out[:row,2:] = Z[:row,2:]
+    out[row+1:,2:] = Z[row:,2:]
+    node_id = node if node < n else (node + 1 if node - n < row else node + 2)
+    out[row] = (node_id, n, distance, size + 1)
+
+    if(node != root):
+        #the joined merge now points at the new one, and every cluster above it holds one more leaf
+        joined = out[parent[node] - n + 1,:2]
+        joined[joined == node_id] = n + 1 + row
+        ancestor = parent[node]
+        while(True):
+            out[ancestor - n + 1, 3] += 1
+            if(ancestor == root):
+                break
+            ancestor = parent[ancestor]
+    return out
+
+
+def _subtree(Z, node, n):
+    #the merges (in merge order) and the leaves (in id order) below node
+    merges = []
+    leaves = []
+    stack = [node]
+    while(stack):
+        node = stack.pop()
+        if(node < n):
+            leaves.append(node)
+        else:
+            merges.append(node - n)
+            stack.extend(int(child) for child in Z[node - n, :2])
+    return np.sort(merges), np.sort(leaves)
+
+
+def optimal_leaf_ordering(linkage, data, metric='euclidean', window=256):
+    """
+    Returns a copy of linkage with the children of its merges swapped so that neighbouring leaves are close together
+    (by metric on the rows of data), like scipy.cluster.hierarchy.optimal_leaf_ordering. That is exact but takes
+    O(n^3) time and O(n^2) memory, so only subtrees of at most window leaves are ordered exactly (window=None orders
+    the whole tree exactly). Each merge above them then keeps whichever of the four orientations of its two children
+    puts the closest pair of leaves next to each other. The clusters are unchanged, only the order of the leaves.
+    """
+    Z = np.array(linkage, dtype=float)
+    data = np.asarray(data)
+    n = Z.shape[0] + 1
+    if(window is None or n <= window):
+        return sch.optimal_leaf_ordering(Z, ssd.pdist(data, metric))
+
+    children = Z[:,:2].astype(int)
+    sizes = np.concatenate([np.ones(n), Z[:,3]])
+    first = np.arange(2*n - 1)
+    last = np.arange(2*n - 1)
+    #flipped[node]: the node's leaves are reversed relative to its parent, applied once all merges are oriented
+    flipped = np.zeros(2*n - 1, dtype=bool)
+    for merge in np.flatnonzero(sizes[n:] > window):
+        left, right = children[merge]
+        for child in (left, right):
+            if(child >= n and sizes[child] <= window):
+                rows, leaves = _subtree(Z, child, n)
+                ids = np.concatenate([leaves, rows + n])
+                position = dict(zip(ids, range(len(ids))))
+                sub = Z[rows].copy()
+                sub[:,:2] = [[position[int(a)], position[int(b)]] for a, b in children[rows]]
+                sub = sch.optimal_leaf_ordering(sub, ssd.pdist(data[leaves], metric))
+                Z[rows, :2] = ids[sub[:,:2].astype(int)]
+                order = leaves[sch.leaves_list(sub)]
+                first[child], last[child] = order[0], order[-1]
+        #distances from the possible last leaves of the left child to the possible first leaves of the right one
+        distances = ssd.cdist(data[[last[left], first[left]]], data[[first[right], last[right]]], metric)
+        flip_left, flip_right = np.unravel_index(np.argmin(distances), (2, 2))
+        flipped[left] = flip_left
+        flipped[right] = flip_right
+        first[n + merge] = last[left] if flip_left else first[left]
+        last[n + merge] = first[right] if flip_right else last[right]
+
+    #a reversed subtree has the children of every merge in it swapped
+    children = Z[:,:2].astype(int)
+    for merge in range(n - 2, -1, -1):
+        if(flipped[n + merge]):
+            Z[merge, :2] = Z[merge, 1::-1]
+            flipped[children[merge]] ^= True
+    return Z
+
+
+class LinkageCuts(object):
+    """
+    Flat clusterings of one linkage, the same as scipy.cluster.hierarchy.fcluster gives, for any threshold.
+
+    A cut joins every merge whose key (the highest merge below it for 'distance' and 'maxclust', its highest
+    inconsistency coefficient for 'inconsistent') is at most the threshold. Keys only grow towards the root, so a cut
+    is fully described by how many merges it joins in order of their keys. The keys are sorted once per criterion,
+    and the clusters of a cut are found by joining those merges all at once (each leaf jumps up to the highest joined
+    merge above it), instead of walking the tree again as fcluster does.
+    """
+
+    def __init__(self, linkage, maxsize=16):
+        self.linkage = np.asarray(linkage, dtype=float)
+        self.n = self.linkage.shape[0] + 1
+        self.maxsize = maxsize
+        children = self.linkage[:,:2].astype(int)
+        self.__parent = np.arange(2*self.n - 1)
+        self.__parent[children[:,0]] = self.__parent[children[:,1]] = np.arange(self.n, 2*self.n - 1)
+        self.__leaves = sch.leaves_list(self.linkage)
+        self.__keys = {}
+        self.__ticks = None
+        self.__labels = collections.OrderedDict()
+        #the cuts of a cached layout are shared by the plots being rendered, in any thread
+        self.__lock = threading.Lock()
+
+    def __walk(self):
+        """
+        Returns the ticks at which fcluster's depth first walk (left child first, merges only) enters and leaves each
+        merge. A merge is entered right after its parent, or after its parent and its left sibling's whole subtree,
+        and the subtree of a merge holding m merges takes 2*m ticks. Entering ticks are summed up the tree by doubling.
+        """
+        if(self.__ticks is None):
+            n = self.n
+            children = self.linkage[:,:2].astype(int)
+            merges = self.linkage[:,3] - 1
+            steps = np.zeros(n - 1, dtype=int)
+            left_merge = children[:,0] >= n
+            right_merge = children[:,1] >= n
+            steps[children[left_merge, 0] - n] = 1
+            skipped = np.where(left_merge, 2*merges[np.maximum(children[:,0] - n, 0)], 0)
+            steps[children[right_merge, 1] - n] = 1 + skipped[right_merge]
+            #enter sums the steps from each merge up to (not including) up, the root takes no step
+            up = self.__parent[n:] - n
+            enter = steps
+            while(np.any(up != n - 2)):
+                enter = enter + enter[up]
+                up = up[up]
+            self.__ticks = (enter, enter + 2*merges.astype(int) - 1)
+        return self.__ticks
+
+    def __sortedKeys(self, criterion, depth):
+        #(keys of the merges, the same keys sorted)
+        key = (criterion, depth if criterion == 'inconsistent' else None)
+        if(key not in self.__keys):
+            if(criterion in ('distance', 'maxclust')):
+                values = sch.maxdists(self.linkage)
+            elif(criterion == 'inconsistent'):
+                values = sch.maxinconsts(self.linkage, sch.inconsistent(self.linkage, depth))
+            else:
+                raise ValueError("Unknown cut criterion '%s', use 'distance', 'maxclust' or 'inconsistent'" % criterion)
+            self.__keys[key] = (values, np.sort(values))
+        return self.__keys[key]
+
+    def joined(self, threshold, criterion='distance', depth=2):
+        """
+        Returns how many merges the cut at threshold joins.
+        """
+        values, ordered = self.__sortedKeys(criterion, depth)
+        if(criterion == 'maxclust'):
+            #the lowest cut leaving at most threshold clusters, merges with equal keys are joined together
+            needed = self.n - int(threshold)
+            if(needed <= 0):
+                return 0
+            return int(np.searchsorted(ordered, ordered[min(needed, self.n - 1) - 1], side='right'))
+        return int(np.searchsorted(ordered, threshold, side='right'))
+
+    def labels(self, threshold, criterion='distance', depth=2):
+        """
+        Returns the flat cluster (numbered from 1, in the order the leaves are drawn) of each observation, as
+        fcluster(linkage, threshold, criterion, depth) does. Recent results are kept, for each number of merges joined.
+        """
+        values, ordered = self.__sortedKeys(criterion, depth)
+        joined = self.joined(threshold, criterion, depth)
+        key = (criterion, depth if criterion == 'inconsistent' else None, joined)
+        with self.__lock:
+            if(key in self.__labels):
+                self.__labels.move_to_end(key)
+                return self.__labels[key]
+
+        if(criterion == 'maxclust' and threshold >= self.n):
+            #fcluster numbers the observations in their own order when every one is its own cluster
+            return self.__keep(key, np.arange(1, self.n + 1))
+
+        applied = np.zeros(2*self.n - 1, dtype=bool)
+        if(joined):
+            applied[self.n:] = values <= ordered[joined - 1]
+        #every node points at its parent if that merge is joined, then the pointers are doubled until they settle
+        nodes = np.arange(2*self.n - 1)
+        up = np.where(applied[self.__parent], self.__parent, nodes)
+        while(True):
+            further = up[up]
+            if(np.array_equal(further, up)):
+                break
+            up = further
+        roots = up[:self.n]
+
+        #fcluster numbers each cluster when its walk reaches it: a cluster of several leaves when the walk enters its
+        #highest merge, a leaf on its own when the walk leaves the merge above it (the left leaf first)
+        enter, leave = self.__walk()
+        parents = self.__parent[:self.n] - self.n
+        order = np.where(roots >= self.n, 2*enter[np.maximum(roots - self.n, 0)],
+                         2*leave[parents] + (self.linkage[parents, 1] == np.arange(self.n)))
+        labels = np.unique(order, return_inverse=True)[1].reshape(self.n) + 1
+        return self.__keep(key, labels)
+
+    def __keep(self, key, labels):
+        with self.__lock:
+            self.__labels[key] = labels
+            while(len(self.__labels) > self.maxsize):
+                self.__labels.popitem(last=False)
+        return labels
+
+    def sweep(self, thresholds, criterion='distance', depth=2):
+        """
+        Returns a len(thresholds) x n array with the labels of each cut.
+        """
+        return np.array([self.labels(threshold, criterion, depth) for threshold in thresholds])
@@ -0,0 +1,140 @@
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2015 Matthew Antalek Jr
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import threading
+from ._lazy import LazyModule
+
+matplotlib = mpl = LazyModule('matplotlib', submodules=('colors', 'cm'))
+
+
+#segment data of the heat map colormaps, the colormaps themselves are only built when first asked for
+_segment_data = {
+    'redBlackSkyBlue': {'red':   ((0.0, 0.0, 0.0),
+                                  (0.5, 0.0, 0.1),
+                                  (1.0, 1.0, 1.0)),
+
+                        'green': ((0.0, 0.0, 0.9),
+                                  (0.5, 0.1, 0.0),
+                                  (1.0, 0.0, 0.0)),
+
+                        'blue':  ((0.0, 0.0, 1.0),
+                                  (0.5, 0.1, 0.0),
+                                  (1.0, 0.0, 0.0))},
+
+    'redBlackBlue':    {'red':   ((0.0, 0.0, 0.0),
+                                  (0.5, 0.0, 0.1),
+                                  (1.0, 1.0, 1.0)),
+
+                        'green': ((0.0, 0.0, 0.0),
+                                  (1.0, 0.0, 0.0)),
+
+                        'blue':  ((0.0, 0.0, 1.0),
+                                  (0.5, 0.1, 0.0),
+                                  (1.0, 0.0, 0.0))},
+
+    'redBlackGreen':   {'red':   ((0.0, 0.0, 0.0),
+                                  (0.5, 0.0, 0.1),
+                                  (1.0, 1.0, 1.0)),
+
+                        'blue':  ((0.0, 0.0, 0.0),
+                                  (1.0, 0.0, 0.0)),
+
+                        'green': ((0.0, 0.0, 1.0),
+                                  (0.5, 0.1, 0.0),
+                                  (1.0, 0.0, 0.0))},
+
+    ### yellow is created by adding y = 1 to RedBlackSkyBlue green last tuple
+    ### modulate between blue and cyan using the last y var in the first green tuple
+    'yellowBlackBlue': {'red':   ((0.0, 0.0, 0.0),
+                                  (0.5, 0.0, 0.1),
+                                  (1.0, 1.0, 1.0)),
+
+                        'green': ((0.0, 0.0, 0.8),
+                                  (0.5, 0.1, 0.0),
+                                  (1.0, 1.0, 1.0)),
+
+                        'blue':  ((0.0, 0.0, 1.0),
+                                  (0.5, 0.1, 0.0),
+                                  (1.0, 0.0, 0.0))},
+}
+
+colormap_names = tuple(sorted(_segment_data))
+
+_cluster_colors = ['r', 'g', 'b', 'y', 'w', 'k', 'm']
+_default_cluster_classes = 10
+
+_colormaps = {}
+_lock = threading.Lock()
+
+
+def _register(name, colormap):
+    #make the lookup table now, so every plot using the colormap shares it instead of building its own
+    colormap(0.0)
+    registry = getattr(mpl, 'colormaps', None)
+    if(registry is None):
+        if(name not in mpl.cm.cmap_d):
+            mpl.cm.register_cmap(name=name, cmap=colormap)
+    elif(name not in registry):
+        registry.register(colormap, name=name)
+    _colormaps[name] = colormap
+    return colormap
+
+
+def get_colormap(colormap):
+    """
+    Returns the colormap for a name, building and registering it with matplotlib the first time. Colormap objects
+    are returned as they are, and names that are not ours are looked up in matplotlib's registry.
+    """
+    if(not isinstance(colormap, str)):
+        return colormap
+    if(colormap in _colormaps):
+        return _colormaps[colormap]
+    with _lock:
+        if(colormap in _colormaps):
+            return _colormaps[colormap]
+        if(colormap in _segment_data):
+            return _register(colormap, mpl.colors.LinearSegmentedColormap(colormap, _segment_data[colormap], 256))
+        return _register(colormap, mpl.colormaps[colormap])
+
+
+def cluster_colormap_name(n_classes=None):
+    """
+    Name of the colormap used for colorbars with n_classes clusters.
+    """
+    if(n_classes is None):
+        n_classes = _default_cluster_classes
+    return 'clusters%d' % max(int(n_classes), 1)
+
+
+def cluster_colormap(n_classes=None):
+    """
+    The colorbar colormap with n_classes colors, each size is built once and shared.
+    """
+    name = cluster_colormap_name(n_classes)
+    if(name in _colormaps):
+        return _colormaps[name]
+    with _lock:
+        if(name not in _colormaps):
+            _register(name, mpl.colors.LinearSegmentedColormap.from_list(name=name, colors=_cluster_colors,
+                                                                          N=int(name[len('clusters'):])))
+        return _colormaps[name]
@@ -0,0 +1,188 @@
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2015 Matthew Antalek Jr
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import sys
+import numpy as np
+from .pydendroheatmap import DendroHeatMap, mpl, pylab, _font_size
+
+
+class MultiPanelHeatMap(object):
+    """
+    Several heat maps drawn side by side in one figure against one shared row dendrogram and row colorbar, e.g.
+    expression, methylation and copy number of the same samples. Each panel is a DendroHeatMap without a left
+    dendrogram, so it keeps its own data, colormap, normalization (norm_percentiles, norm_center, norm_scale), top
+    dendrogram and column labels, and its color legend is titled with its color_legend_title. The rows of every panel
+    must be in the order of the left dendrogram's leaves.
+
+    The positions of the panels are computed once by the MultiPanelHeatMap and overwrite theirs. The row dendrogram is
+    laid out and cut once, by a panel of its own (tree) that only draws the dendrogram and the row colorbar.
+
+        plot = MultiPanelHeatMap([expression, methylation], left_dendrogram=Z, row_labels=samples)
+        plot.export('layers.png')
+    """
+
+    #the same margins as a single DendroHeatMap, with the panels sharing the space right of the row colorbar
+    left_dendro_x = 0.05
+    row_cb_x = 0.254
+    panels_x = 0.273
+    panels_right = 0.87
+    panel_gap = 0.01
+    bottom = 0.22
+    height = 0.6
+    legend_y = 0.03
+    legend_height = 0.03
+
+    def __init__(self, panels, left_dendrogram=None, row_labels=None, left_cut=None, left_leaf_sizes=None,
+                 window_height=10, window_width=14, panel_widths=None, title=''):
+        self.panels = [panel if isinstance(panel, DendroHeatMap) else DendroHeatMap(heat_map_data=panel)
+                       for panel in panels]
+        if(not self.panels):
+            raise ValueError('A MultiPanelHeatMap needs at least one panel')
+        rows = set(panel.heat_map_data.shape[0] for panel in self.panels if panel.heat_map_data is not None)
+        if(len(rows) > 1):
+            raise ValueError('Every panel must have the same number of rows, got %s' % sorted(rows))
+        for panel in self.panels:
+            if(panel.left_dendrogram is not None):
+                raise ValueError('The panels share the MultiPanelHeatMap\'s left_dendrogram and must not have their own')
+        self.__checkRowLabels()
+        self.tree = DendroHeatMap(left_dendrogram=left_dendrogram, left_cut=left_cut)
+        if(left_leaf_sizes is not None):
+            self.tree.left_leaf_sizes = left_leaf_sizes
+        self.row_labels = row_labels
+        self.window_height = window_height
+        self.window_width = window_width
+        self.panel_widths = panel_widths
+        self.title = title
+        self.exportDPI = 600
+        self.figure = None
+        self.__layout = None
+
+    @property
+    def left_dendrogram(self):
+        return self.tree.left_dendrogram
+
+    @left_dendrogram.setter
+    def left_dendrogram(self, left_dendrogram):
+        self.tree.left_dendrogram = left_dendrogram
+
+    def __checkRowLabels(self):
+        for panel in self.panels:
+            if(panel.row_labels is not None):
+                raise ValueError('The panels share the MultiPanelHeatMap\'s row_labels and must not have their own')
+
+    def __layoutKey(self):
+        return (len(self.panels), None if self.panel_widths is None else tuple(self.panel_widths),
+                self.window_height, self.window_width)
+
+    def __layoutPanels(self):
+        """
+        Sets the positions of the tree and of every panel, once per number of panels, panel widths and window size.
+        """
+        key = self.__layoutKey()
+        if(key == self.__layout):
+            return False
+        widths = np.ones(len(self.panels)) if self.panel_widths is None else np.asarray(self.panel_widths, dtype=float)
+        space = self.panels_right - self.panels_x - self.panel_gap*(len(self.panels) - 1)
+        widths = space*widths/widths.sum()
+        lefts = self.panels_x + np.concatenate([[0], np.cumsum(widths + self.panel_gap)[:-1]])
+
+        for part in [self.tree] + self.panels:
+            part.window_height = self.window_height
+            part.window_width = self.window_width
+            part.left_dendro_x = self.left_dendro_x
+            part.left_dendro_y = part.row_cb_y = part.heat_y = self.bottom
+            part.left_dendro_height = part.row_cb_height = part.heat_height = self.height
+            part.row_cb_x = self.row_cb_x
+        for panel, left, width in zip(self.panels, lefts.tolist(), widths.tolist()):
+            panel.heat_x = panel.top_dendro_x = panel.col_cb_x = left
+            panel.heat_width = panel.top_dendro_width = panel.col_cb_width = width
+            legend_width = min(0.2, 0.8*width)
+            panel.color_legend_x = left + (width - legend_width)/2.0
+            panel.color_legend_y = self.legend_y
+            panel.color_legend_width = legend_width
+            panel.color_legend_height = self.legend_height
+            #about two ticks per inch, so narrow legends stay legible
+            panel.color_legend_ticks = min(panel.color_legend_ticks, max(2, int(2*legend_width*self.window_width)))
+        self.__layout = key
+        return True
+
+    def render_plot(self, dpi=None, figure=None):
+        """
+        Draws the tree and every panel into one figure (a new one with an Agg canvas unless figure is given). As with
+        DendroHeatMap.render_plot, rendering again only redraws the parts of the panels that changed.
+        """
+        self.__checkRowLabels()
+        #the shared row labels are drawn right of the last panel, which only holds them while it is drawn
+        last = self.panels[-1]
+        last.row_labels = self.row_labels
+        try:
+            self.__renderParts(dpi, figure)
+        finally:
+            last.row_labels = None
+        self.figure.suptitle(self.title, fontsize=_font_size('figure.titlesize', self.panels[0].font_size))
+
+    def __renderParts(self, dpi, figure):
+        parts = [self.tree] + self.panels
+        rebuild = self.__layoutPanels() or figure is not None or self.figure is None
+        for attempt in range(2):
+            if(rebuild):
+                if(figure is None):
+                    figure = mpl.figure.Figure(figsize=[self.window_width, self.window_height])
+                    mpl.backends.backend_agg.FigureCanvasAgg(figure)
+                self.figure = figure
+            for part in parts:
+                part.render_plot(dpi=dpi, figure=self.figure if rebuild else None)
+            #a part whose own layout changed has drawn itself into a figure of its own, so draw them all again
+            if(all(part.figure is self.figure for part in parts)):
+                break
+            rebuild = True
+            figure = None
+
+    def show(self):
+        if(self.figure is None or not pylab.fignum_exists(getattr(self.figure, 'number', None))):
+            self.render_plot(figure=pylab.figure(figsize=[self.window_width, self.window_height]))
+        else:
+            self.render_plot()
+        pylab.show()
+
+    def export(self, filename, format=None):
+        """
+        Saves the plot to filename, in the format its extension names. As with DendroHeatMap.export, filename can
+        also be a binary file object such as io.BytesIO, written in format ('png' unless given).
+        """
+        if(not isinstance(filename, str)):
+            extension = (format or 'png').lower()
+        else:
+            if('.' not in filename):
+                filename += '.' + (format or 'png')
+            extension = (format or filename.rsplit('.', 1)[-1]).lower()
+        self.render_plot(dpi=self.exportDPI)
+        self.figure.savefig(filename, dpi=self.exportDPI, format=extension)
+
+    def resetPlot(self):
+        for part in [self.tree] + self.panels:
+            part.figure = None
+            part.resetPlot()
+        if(self.figure is not None and 'matplotlib.pyplot' in sys.modules):
+            sys.modules['matplotlib.pyplot'].close(self.figure)
+        self.figure = None
@@ -21,11 +21,482 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 # THE SOFTWARE.
 
-import matplotlib.pyplot as pylab
-import matplotlib
-import matplotlib as mpl
-import scipy.cluster.hierarchy as sch
 import numpy as np
+import os
+import sys
+import collections
+import contextlib
+import hashlib
+import io
+import json
+import threading
+import time
+import concurrent.futures
+import tracemalloc
+from ._lazy import LazyModule
+from .clustering import (cluster_matrix, linkage_matrix, two_stage_linkage, expand_leaves, insert_leaf,
+                         optimal_leaf_ordering, LinkageCuts)
+from .colormaps import get_colormap, cluster_colormap
+from .raster import colormap_lut, render_pixels, pixel_artist, write_png, iter_colored_rows
+from .chunked import (is_in_memory, is_array_like, chunk_rows, iter_row_chunks, min_max, reorder_matrix, take_stacked_rows,
+                      sample_values, moments)
+
+#matplotlib and scipy are only imported once a plot is rendered or a linkage is laid out
+pylab = LazyModule('matplotlib.pyplot')
+matplotlib = mpl = LazyModule('matplotlib', submodules=('colors', 'collections', 'colorbar', 'figure', 'patches', 'path',
+                                                        'font_manager', 'ticker', 'backends.backend_agg'))
+sch = LazyModule('scipy.cluster.hierarchy')
+ssd = LazyModule('scipy.spatial.distance')
+
+
+
+#same palette sch.dendrogram uses, C0 is reserved for links above the color threshold
+_link_line_colors = ('C1', 'C2', 'C3', 'C4', 'C5', 'C6', 'C7', 'C8', 'C9')
+_above_threshold_color = 'C0'
+
+
+def _dendrogram_layout(linkage, color_threshold=None):
+    """
+    Computes the same link coordinates and colors as sch.dendrogram(linkage, no_plot=True), but iteratively and into
+    (n-1) x 4 arrays, so trees with 100k+ leaves can be laid out without recursion. Links are in merge order.
+    """
+    Z = np.asarray(linkage, dtype=float)
+    n = Z.shape[0] + 1
+    left = Z[:,0].astype(int)
+    right = Z[:,1].astype(int)
+    heights = Z[:,2]
+
+    leaves = sch.leaves_list(Z)
+    rank = np.empty(n, dtype=int)
+    rank[leaves] = np.arange(n)
+
+    #x position and leftmost leaf rank of every node, leaves first and then the merges in order
+    x = (10.0*rank + 5.0).tolist() + [0.0]*(n-1)
+    first = rank.tolist() + [0]*(n-1)
+    for i, (a, b) in enumerate(zip(left.tolist(), right.tolist())):
+        x[n+i] = (x[a] + x[b])/2.0
+        first[n+i] = first[a]
+    x = np.array(x)
+    first = np.array(first)
+    node_heights = np.concatenate([np.zeros(n), heights])
+
+    icoord = np.column_stack([x[left], x[left], x[right], x[right]])
+    dcoord = np.column_stack([node_heights[left], heights, heights, node_heights[right]])
+
+    if(color_threshold is None):
+        color_threshold = 0.7*heights.max() if len(heights) else 0
+    #sch.dendrogram walks the links in order and moves to the next color whenever it leaves a run of links below the
+    #threshold. The in-order position of a link is the rank of the first leaf of its right child.
+    below = heights < color_threshold
+    if(color_threshold <= 0):
+        below[:] = False
+    in_order = np.argsort(first[right])
+    below_in_order = below[in_order]
+    run_starts = below_in_order & ~np.concatenate([[False], below_in_order[:-1]])
+    color_index = np.empty(n-1, dtype=int)
+    color_index[in_order] = (np.cumsum(run_starts) - 1) % len(_link_line_colors)
+    colors = np.array(_link_line_colors)[color_index]
+    colors[~below] = _above_threshold_color
+
+    return {'leaves':leaves, 'icoord':icoord, 'dcoord':dcoord, 'color_list':colors.tolist(),
+            'color_threshold':color_threshold}
+
+
+def _leaf_coordinates(layout, leaf_sizes=None):
+    #the icoord of the layout and the number of leaf slots. leaf_sizes (the rows under each leaf of a collapsed tree)
+    #widens each leaf to cover its rows
+    icoord = layout['icoord']
+    n_leaves = len(layout['leaves'])
+    if(leaf_sizes is not None):
+        sizes = np.asarray(leaf_sizes)[layout['leaves']]
+        centers = 10.0*(np.cumsum(sizes) - sizes/2.0)
+        icoord = np.interp(icoord, 10.0*np.arange(n_leaves) + 5.0, centers)
+        n_leaves = sizes.sum()
+    return icoord, n_leaves
+
+
+def _draw_dendrogram(axes, layout, orientation='top', leaf_sizes=None):
+    #all links of the tree go into a single LineCollection, links above the color threshold are drawn last
+    icoord, n_leaves = _leaf_coordinates(layout, leaf_sizes)
+    dcoord = layout['dcoord']
+    colors = np.array(layout['color_list'])
+    draw_order = np.argsort(colors == _above_threshold_color, kind='stable')
+    if(orientation == 'left'):
+        segments = np.stack([dcoord, icoord], axis=-1)
+    else:
+        segments = np.stack([icoord, dcoord], axis=-1)
+
+    #resolve each distinct color once instead of once per link
+    unique, inverse = np.unique(colors[draw_order], return_inverse=True)
+    rgba = mpl.colors.to_rgba_array(unique)[inverse.ravel()]
+    collection = mpl.collections.LineCollection(segments[draw_order], colors=rgba)
+    axes.add_collection(collection)
+
+    max_height = dcoord.max() if len(dcoord) else 0
+    leaf_extent = [0, n_leaves*10]
+    height_extent = [0, max_height + max_height*0.05]
+    if(orientation == 'left'):
+        axes.set_xlim(height_extent[::-1])
+        axes.set_ylim(leaf_extent)
+    else:
+        axes.set_xlim(leaf_extent)
+        axes.set_ylim(height_extent)
+    return collection
+
+
+def _dendrogram_paths(linkage, layout, orientation, tolerance, leaf_sizes=None):
+    """
+    Returns the links of a dendrogram as (color, matplotlib Path) pairs, one path per color with links above the color
+    threshold last, for vector output where every separately drawn segment adds to the file. A link whose legs are
+    less than tolerance (in leaf coordinates, e.g. one pixel) apart is drawn as a single vertical line in the middle.
+    That line is collinear with the leg joining the link to its parent, so when both have the same color they are
+    merged into one segment, all the way up a chain of narrow links.
+    """
+    icoord, n_leaves = _leaf_coordinates(layout, leaf_sizes)
+    dcoord = layout['dcoord']
+    colors = np.array(layout['color_list'])
+    children = np.asarray(linkage)[:,:2].astype(int)
+    n = len(children) + 1
+    narrow = np.abs(icoord[:,2] - icoord[:,1]) < tolerance
+    parent = np.full(n - 1, -1)
+    internal = children >= n
+    parent[children[internal] - n] = np.nonzero(internal)[0]
+    has_parent = parent >= 0
+    #a narrow link is absorbed by the leg (or line) of a parent of the same color
+    absorbed = narrow & has_parent
+    absorbed[has_parent] &= colors[has_parent] == colors[parent[has_parent]]
+
+    #the legs start where the merged lines of absorbed children start
+    bottoms = dcoord[:,[0, 3]].copy()
+    lowest = bottoms.min(axis=1)
+    absorbed_children = np.where(internal, absorbed[np.clip(children - n, 0, None)], False)
+    for link in np.flatnonzero(absorbed_children.any(axis=1)):
+        for side in (0, 1):
+            if(absorbed_children[link, side]):
+                bottoms[link, side] = lowest[children[link, side] - n]
+        lowest[link] = bottoms[link].min()
+
+    heights = dcoord[:,1]
+    paths = []
+    for color in sorted(set(colors.tolist()), key=lambda color: color == _above_threshold_color):
+        wide = np.flatnonzero((colors == color) & ~narrow)
+        lines = np.flatnonzero((colors == color) & narrow & ~absorbed)
+        shapes = np.stack([icoord[wide], np.column_stack([bottoms[wide,0], heights[wide], heights[wide],
+                                                          bottoms[wide,1]])], axis=-1).reshape(-1, 2)
+        middle = (icoord[lines,1] + icoord[lines,2])/2.0
+        verticals = np.stack([np.repeat(middle, 2), np.column_stack([lowest[lines], heights[lines]]).ravel()], axis=-1)
+        vertices = np.concatenate([shapes, verticals])
+        if(orientation == 'left'):
+            vertices = vertices[:,::-1]
+        codes = np.full(len(vertices), mpl.path.Path.LINETO, dtype=mpl.path.Path.code_type)
+        codes[:4*len(wide):4] = mpl.path.Path.MOVETO
+        codes[4*len(wide)::2] = mpl.path.Path.MOVETO
+        paths.append((color, mpl.path.Path(vertices, codes)))
+    return paths
+
+
+def _font_size(key, font_size):
+    #matplotlib's default size for a kind of text (e.g. 'axes.titlesize') with font_size in place of rcParams['font.size'],
+    #passed to each artist since rcParams is shared by every plot being rendered, in any thread
+    size = matplotlib.rcParams[key]
+    if(isinstance(size, str)):
+        return mpl.font_manager.font_scalings[size]*font_size
+    return size
+
+
+def _label_positions(n_labels, axis_inches, dpi, font_size, max_labels):
+    """
+    Returns the evenly spaced indices of the labels that fit along an axis of the given length, without overlapping
+    and without exceeding max_labels.
+    """
+    label_pixels = font_size*dpi/72.0*1.2
+    fit = int(axis_inches*dpi/label_pixels)
+    limit = max(1, min(fit, max_labels))
+    step = int(np.ceil(n_labels/float(limit)))
+    return np.arange(0, n_labels, max(step, 1))
+
+
+def _block_starts(n, n_blocks):
+    #first index of each of (at most) n_blocks nearly equal blocks covering range(n)
+    if(n <= n_blocks):
+        return None
+    return np.unique(np.linspace(0, n, n_blocks, endpoint=False).astype(int))
+
+
+def _block_reduce(data, row_starts, col_starts, how='mean'):
+    """
+    Reduces data to one value per block, where blocks are delimited by row_starts and col_starts (None leaves that
+    axis unreduced). how is one of 'mean', 'max', 'min' or 'absmax'. Means are summed in float64 but returned as
+    float32 for float32 (or smaller) data.
+    """
+    data = np.asarray(data)
+    if(row_starts is None):
+        row_starts = np.arange(data.shape[0])
+    if(col_starts is None):
+        col_starts = np.arange(data.shape[1])
+
+    if(how == 'mean'):
+        sums = np.add.reduceat(np.add.reduceat(data, row_starts, axis=0, dtype=np.float64), col_starts, axis=1)
+        row_counts = np.diff(np.append(row_starts, data.shape[0]))
+        col_counts = np.diff(np.append(col_starts, data.shape[1]))
+        means = sums/np.outer(row_counts, col_counts)
+        return means.astype(np.result_type(data.dtype, np.float32), copy=False)
+    elif(how == 'max'):
+        return np.maximum.reduceat(np.maximum.reduceat(data, row_starts, axis=0), col_starts, axis=1)
+    elif(how == 'min'):
+        return np.minimum.reduceat(np.minimum.reduceat(data, row_starts, axis=0), col_starts, axis=1)
+    elif(how == 'absmax'):
+        highest = _block_reduce(data, row_starts, col_starts, 'max')
+        lowest = _block_reduce(data, row_starts, col_starts, 'min')
+        return np.where(np.abs(lowest) > np.abs(highest), lowest, highest)
+    else:
+        raise ValueError("Unknown aggregation '%s', use one of 'mean', 'max', 'min' or 'absmax'" % how)
+
+
+def _block_reduce_chunked(data, row_starts, col_starts, how='mean', transform=None):
+    #same as _block_reduce, but for data that is not in memory, reading whole row blocks one chunk at a time.
+    #transform(block, rows) is applied to each block before it is reduced.
+    if(is_in_memory(data)):
+        if(transform is not None):
+            data = transform(data, np.arange(data.shape[0]))
+        return _block_reduce(data, row_starts, col_starts, how)
+    if(row_starts is None):
+        row_starts = np.arange(data.shape[0])
+
+    row_ends = np.append(row_starts[1:], data.shape[0])
+    rows_per_chunk = chunk_rows(data)
+    reduced = []
+    first = 0
+    while(first < len(row_starts)):
+        last = max(first + 1, np.searchsorted(row_ends, row_starts[first] + rows_per_chunk, side='right'))
+        start = row_starts[first]
+        block = np.asarray(data[start:row_ends[last-1]])
+        if(transform is not None):
+            block = transform(block, np.arange(start, row_ends[last-1]))
+        reduced.append(_block_reduce(block, row_starts[first:last] - start, col_starts, how))
+        first = last
+    return np.vstack(reduced)
+
+
+#the coarsest level of detail has at most this many blocks along each axis
+_lod_min_blocks = 256
+
+#the visible window is taken from a coarser level once it would hold more than this many blocks per pixel
+_lod_max_blocks_per_pixel = 4
+
+
+def _absmax(a, b):
+    #whichever of a and b is further from zero, the larger one on ties (as _block_reduce does)
+    return np.where(np.abs(a) == np.abs(b), np.maximum(a, b), np.where(np.abs(a) > np.abs(b), a, b))
+
+
+_pair_functions = {'mean':np.add, 'max':np.maximum, 'min':np.minimum, 'absmax':_absmax}
+
+
+def _pairwise(image, axis, function):
+    #combines neighbouring pairs of rows (axis 0) or columns (axis 1), an odd one out at the end is kept as it is
+    image = np.moveaxis(image, axis, 0)
+    n = image.shape[0]
+    combined = function(image[0:n-1:2], image[1::2])
+    if(n % 2):
+        combined = np.concatenate([combined, image[n-1:]])
+    return np.moveaxis(combined, 0, axis)
+
+
+def _lod_halve(image, how='mean', row_counts=None, col_counts=None):
+    """
+    Merges each 2x2 block of image into one value (fewer at the bottom and right edges). For means, row_counts and
+    col_counts give how many values of the full matrix are behind each row and column of image (None for one each),
+    so that the blocks at the edges are weighted correctly.
+    """
+    if(how not in _pair_functions):
+        raise ValueError("Unknown aggregation '%s', use one of 'mean', 'max', 'min' or 'absmax'" % how)
+    function = _pair_functions[how]
+    if(how != 'mean'):
+        return _pairwise(_pairwise(image, 0, function), 1, function)
+
+    dtype = np.result_type(image.dtype, np.float32)
+    row_counts = np.ones(image.shape[0], dtype=dtype) if row_counts is None else np.asarray(row_counts, dtype=dtype)
+    col_counts = np.ones(image.shape[1], dtype=dtype) if col_counts is None else np.asarray(col_counts, dtype=dtype)
+    sums = np.asarray(image, dtype=dtype)*row_counts[:,None]*col_counts
+    sums = _pairwise(_pairwise(sums, 0, np.add), 1, np.add)
+    return sums/_pairwise(row_counts, 0, np.add)[:,None]/_pairwise(col_counts, 0, np.add)
+
+
+def _lod_counts(n, size):
+    #how many rows (or columns) of the full matrix are behind each block of a level with blocks of size values
+    return np.diff(np.append(np.arange(0, n, size), n))
+
+
+def _lod_pyramid(data, how='mean', transform=None):
+    """
+    Builds the levels of detail used to zoom around large heat maps. Level k reduces data to blocks of 2**k x 2**k
+    values (smaller at the edges), and is computed from level k-1, so data is only read once, one chunk of rows at a
+    time. Level 0 is data itself and is not stored: the returned list starts at level 1 and ends once both axes fit
+    in _lod_min_blocks blocks. transform(block, rows) is applied to the data as it is read.
+    """
+    rows, cols = data.shape
+    levels = []
+    size = 1
+    while(max(-(-rows//size), -(-cols//size)) > _lod_min_blocks):
+        if(not levels):
+            #an even number of rows per chunk keeps the pairs of rows within a chunk
+            rows_per_chunk = chunk_rows(data)
+            rows_per_chunk += rows_per_chunk % 2
+            halves = []
+            for start, block in iter_row_chunks(data, rows_per_chunk):
+                if(transform is not None):
+                    block = transform(block, np.arange(start, start + block.shape[0]))
+                halves.append(_lod_halve(block, how))
+            image = np.concatenate(halves)
+        else:
+            image = _lod_halve(levels[-1], how, _lod_counts(rows, size), _lod_counts(cols, size))
+        size *= 2
+        levels.append(image)
+    return levels
+
+
+def _rescale_limits(limits, start, stop, new_start, new_stop):
+    #the data limits of an axis spanning new_start..new_stop pixels, when limits span start..stop
+    scale = (limits[1] - limits[0])/(stop - start)
+    return (limits[0] + (new_start - start)*scale, limits[0] + (new_stop - start)*scale)
+
+
+#formats export() can draw the heat map into with render_pixels when raster_export is set
+_raster_formats = ('png', 'jpg', 'jpeg', 'tif', 'tiff', 'webp', 'raw', 'rgba')
+
+#formats export() rasterizes the heat map and simplifies the dendrograms for when vector_export is set
+_vector_formats = ('pdf', 'svg', 'svgz', 'eps', 'ps')
+
+
+#how many values the percentile based normalizations are estimated from
+_norm_sample_size = 2**20
+
+
+def _labels_state(labels):
+    #a copy of the labels to compare against later, since label lists may be changed in place
+    return None if labels is None else tuple(labels)
+
+
+def _linkage_key(linkage):
+    #key on the contents of the linkage, not its identity, so equal linkages share a layout
+    linkage = np.ascontiguousarray(linkage)
+    digest = hashlib.sha1(linkage.view(np.uint8)).hexdigest()
+    return (digest, linkage.shape, linkage.dtype.str)
+
+
+def _data_digest(data):
+    #sha1 of the shape, type and contents of a matrix, read one chunk of rows at a time
+    digest = hashlib.sha1(('%r %s' % (tuple(data.shape), np.dtype(data.dtype).str)).encode('utf8'))
+    for start, block in iter_row_chunks(data):
+        digest.update(np.ascontiguousarray(block).view(np.uint8))
+    return digest.hexdigest()
+
+
+def _spec_value(value):
+    #value as plain JSON types, with arrays replaced by a hash of their contents
+    if(value is None or isinstance(value, (bool, int, float, str))):
+        return value
+    if(isinstance(value, np.generic)):
+        return value.item()
+    if(isinstance(value, np.ndarray)):
+        if(value.dtype == object):
+            return [_spec_value(item) for item in value.ravel()] + [list(value.shape)]
+        return list(_linkage_key(value))
+    if(isinstance(value, (list, tuple))):
+        return [_spec_value(item) for item in value]
+    if(isinstance(value, dict)):
+        return dict((str(key), _spec_value(item)) for key, item in value.items())
+    if('matplotlib.colors' in sys.modules and isinstance(value, mpl.colors.Colormap)):
+        #colormap objects by their colors, names need not be unique
+        return [value.name, hashlib.sha1(colormap_lut(value).tobytes()).hexdigest()]
+    return getattr(value, 'name', repr(value))
+
+
+class _LayoutCache(object):
+    """
+    Least recently used cache of dendrogram layouts. Each entry holds the leaf order, the icoord/dcoord link coordinates,
+    the link colors, the flat cluster labels and the LinkageCuts for one linkage matrix, so a linkage is never laid out
+    twice.
+    """
+
+    def __init__(self, maxsize=32):
+        self.maxsize = maxsize
+        self.__entries = collections.OrderedDict()
+        #plots are rendered from several threads, the layout itself is computed outside of the lock
+        self.__lock = threading.Lock()
+
+    def get(self, linkage, stage=None):
+        #stage(name) may return a context manager to time the layout and clustering with when they are computed
+        key = _linkage_key(linkage)
+        with self.__lock:
+            if(key in self.__entries):
+                self.__entries.move_to_end(key)
+                return self.__entries[key]
+
+        stage = stage or (lambda name: contextlib.nullcontext())
+        with stage('dendrogram_layout'):
+            layout = _dendrogram_layout(linkage)
+            #the leaf order is shared by everything drawn from this linkage, so it must not be changed in place
+            layout['leaves'].flags.writeable = False
+        with stage('cluster_labels'):
+            layout['cuts'] = LinkageCuts(linkage)
+            layout['clusters'] = layout['cuts'].labels(0.7*max(linkage[:,2]), 'distance')
+        with self.__lock:
+            self.__entries[key] = layout
+            while(len(self.__entries) > self.maxsize):
+                self.__entries.popitem(last=False)
+        return layout
+
+    def clear(self):
+        with self.__lock:
+            self.__entries.clear()
+
+    def __len__(self):
+        return len(self.__entries)
+
+
+_layout_cache = _LayoutCache()
+
+
+def leaf_order(linkage):
+    """
+    Returns the (cached, read-only) order of the leaves of a linkage matrix as they are drawn, which is the order the
+    rows or columns of the heat map data must be in.
+    """
+    return _layout_cache.get(linkage)['leaves']
+
+
+#linkages reordered by ordered_linkage, keyed by the linkage, the data and the ordering settings
+_orderings = collections.OrderedDict()
+_orderings_maxsize = 16
+_orderings_lock = threading.Lock()
+
+
+def ordered_linkage(linkage, data, metric='euclidean', window=256):
+    """
+    Returns clustering.optimal_leaf_ordering(linkage, data, metric, window), cached by the contents of linkage and
+    data, so reordering the same tree again (e.g. for a rerun or another plot of the same data) is free.
+    """
+    key = (_linkage_key(linkage), _data_digest(data), metric, window)
+    with _orderings_lock:
+        if(key in _orderings):
+            _orderings.move_to_end(key)
+            return _orderings[key]
+    ordered = optimal_leaf_ordering(linkage, data, metric, window)
+    with _orderings_lock:
+        _orderings[key] = ordered
+        while(len(_orderings) > _orderings_maxsize):
+            _orderings.popitem(last=False)
+    return ordered
+
+
+def linkage_cuts(linkage):
+    """
+    Returns the (cached) clustering.LinkageCuts of a linkage matrix, to get the flat clusters of many thresholds, e.g.
+    linkage_cuts(Z).sweep(numpy.linspace(0, Z[:,2].max(), 50)).
+    """
+    return _layout_cache.get(linkage)['cuts']
 
 
 
@@ -77,10 +548,47 @@ class DendroHeatMap(object):
                  max_col_labels=100,
                  col_labels_size=8,
                  font_size = 9,
-                 verbose=False):
+                 verbose=False,
+                 heat_map_aggregation=None,
+                 norm_percentiles=None,
+                 norm_center=None,
+                 norm_scale=None,
+                 heat_map_lod=False,
+                 left_cut=None,
+                 top_cut=None):
 
         self.figure = None
+        self.__rendered = {}
+        self.__versions = collections.Counter()
+        self.profile = {}
+        self.profile_callback = None
+        self.profile_memory = False
+        #set while render_async or export_async work on the plot, the work stops at its next stage once it is set
+        self.__cancel = None
+        self.__lock = threading.Lock()
+        #[traced bytes at the start, peak so far] of each stage being profiled, outermost first
+        self.__stages = []
         self.verbose= verbose
+        self.heat_map_aggregation = heat_map_aggregation
+        self.heat_map_lod = heat_map_lod
+        self.__lod = None
+        self.__lod_view = None
+        self.norm_percentiles = norm_percentiles
+        self.norm_center = norm_center
+        self.norm_scale = norm_scale
+
+        self.row_metric = 'euclidean'
+        self.row_method = 'single'
+        self.leaf_ordering = None
+        self.ordering_window = 256
+        self.recluster_every = None
+        self.__appended_rows = 0
+        self.left_colorbar_labels = None
+        self.left_colorbar_legend_names = None
+        self.top_colorbar_labels = None
+        self.__left_cut = left_cut
+        self.__top_cut = top_cut
+        self.__left_leaf_sizes = None
 
         # print 'should be moving into setter land....'
         self.heat_map_data = heat_map_data
@@ -105,10 +613,8 @@ class DendroHeatMap(object):
         self.top_dendro_width = top_dendro_width
         self.top_dendro_height=top_dendro_height
 
-        # self.cluster_cb_colors = mpl.colors.ListedColormap(['r', 'g', 'b', 'y', 'w', 'k', 'm'])
-        self.cluster_cb_colors = mpl.colors.LinearSegmentedColormap.from_list(name="custom",
-                                                                              colors=['r', 'g', 'b', 'y', 'w', 'k', 'm'],
-                                                                              N=10)
+        #colormaps are given by name and looked up in the shared registry when the plot is rendered
+        self.cluster_cb_colors = None
 
         self.row_cb_x=row_cb_x
         self.row_cb_y = row_cb_y
@@ -141,11 +647,7 @@ class DendroHeatMap(object):
         self.col_labels_size=col_labels_size
         self.max_col_labels=max_col_labels
 
-        self.redBlackBlue=self.__RedBlackBlue()
-        self.redBlackSkyBlue=self.__RedBlackSkyBlue()
-        self.redBlackGreen=self.__RedBlackGreen()
-        self.yellowBlackBlue=self.__YellowBlackBlue()
-        self.colormap=self.redBlackGreen
+        self.colormap=None
 
 
 
@@ -156,125 +658,737 @@ class DendroHeatMap(object):
         self.plotRendered = False
         self.font_size = font_size
         self.exportDPI = 600
+        #draw the heat map's pixels with numpy instead of matplotlib's image resampling when exporting raster formats
+        self.raster_export = False
+        #for vector formats, rasterize the heat map and colorbars at vector_dpi and simplify the dendrograms
+        self.vector_export = False
+        self.vector_dpi = 300
+        #a cache.RenderCache that export() reuses identical plots from, see spec()
+        self.render_cache = None
+        self.__data_digest = None
+
+
+
+
+    @classmethod
+    def from_data(cls, matrix, metric='euclidean', method='single', dtype=None, row_labels=None, col_labels=None,
+                  executor='thread', max_workers=None, out=None, leaf_ordering=None, ordering_window=256, row_clusters=None,
+                  **kwargs):
+        """
+        Clusters the rows and columns of matrix, reorders it by the leaves of both trees and returns a DendroHeatMap
+        with the dendrograms and labels set. metric is passed to scipy.spatial.distance.pdist and method to
+        scipy.cluster.hierarchy.linkage. Use dtype (e.g. numpy.float32) to store the heat map in a smaller type. The rows
+        and columns are clustered concurrently, see clustering.cluster_matrix for executor and max_workers. Any other
+        keyword arguments are passed on to the constructor.
+
+        With leaf_ordering='optimal' the children of each merge are swapped so that neighbouring rows (and columns)
+        are as similar as possible, exactly within subtrees of up to ordering_window leaves and approximately above
+        them, see clustering.optimal_leaf_ordering (ordering_window=None orders the whole tree exactly, which is
+        O(n^3)). The reordered trees are cached, see ordered_linkage.
+
+        A full clustering of n rows needs O(n^2) memory. For matrices with too many rows for that, set row_clusters
+        (e.g. 1000): the rows are then grouped into at most that many clusters by mini-batch k-means and the clusters
+        are linked by their centroids, see clustering.two_stage_linkage. The left dendrogram is this collapsed tree
+        (with left_leaf_sizes set), the rows are grouped by cluster in the order of its leaves and the row colorbar
+        shows the cluster of every row. The columns are clustered over the centroids, each weighted by the square root
+        of its number of rows so that euclidean distances between columns are roughly kept.
+
+        matrix may also be an np.memmap or a chunked array such as an h5py dataset. It is then reordered one chunk of
+        rows at a time into out (e.g. an np.memmap opened in 'w+' mode), which defaults to an in-memory array.
+        """
+        data = matrix if is_array_like(matrix) else np.asarray(matrix)
+        if(len(data.shape) != 2):
+            raise ValueError('Data for the heatmap must be two dimensional, got %d dimension(s)' % len(data.shape))
+        if(leaf_ordering not in (None, 'optimal')):
+            raise ValueError("leaf_ordering must be 'optimal' or None, got %r" % (leaf_ordering,))
+
+        start = time.time()
+        if(row_clusters is None):
+            row_Z, col_Z = cluster_matrix(data, metric=metric, method=method, executor=executor, max_workers=max_workers)
+        else:
+            row_Z, assignments, centroids = two_stage_linkage(data, row_clusters, metric, method, n_threads=max_workers)
+            sizes = np.bincount(assignments, minlength=len(centroids))
+            weighted = centroids*np.sqrt(sizes)[:,None]
+            col_Z = linkage_matrix(weighted.T, metric, method, n_threads=max_workers or os.cpu_count() or 1)
+        clustering_seconds = time.time() - start
+        if(leaf_ordering == 'optimal'):
+            start = time.time()
+            if(row_clusters is None):
+                values = np.asarray(data)
+                row_Z = ordered_linkage(row_Z, values, metric, ordering_window)
+                col_Z = ordered_linkage(col_Z, values.T, metric, ordering_window)
+            else:
+                row_Z = ordered_linkage(row_Z, centroids, metric, ordering_window)
+                col_Z = ordered_linkage(col_Z, weighted.T, metric, ordering_window)
+            ordering_seconds = time.time() - start
+        if(row_clusters is None):
+            row_order = leaf_order(row_Z)
+        else:
+            row_order, sizes = expand_leaves(leaf_order(row_Z), assignments)
+        col_order = leaf_order(col_Z)
+
+        if(out is None):
+            out = np.empty((len(row_order), len(col_order)), dtype=data.dtype if dtype is None else dtype)
+        heatmap = cls(heat_map_data=reorder_matrix(data, row_order, col_order, out=out), left_dendrogram=row_Z,
+                      top_dendrogram=col_Z, **kwargs)
+        heatmap.__record('clustering', clustering_seconds, None)
+        if(row_clusters is not None):
+            heatmap.left_leaf_sizes = sizes
+        if(leaf_ordering is not None):
+            heatmap.__record('leaf_ordering', ordering_seconds, None)
+        heatmap.row_metric = metric
+        heatmap.row_method = method
+        heatmap.leaf_ordering = leaf_ordering
+        heatmap.ordering_window = ordering_window
+        if(row_labels is not None):
+            heatmap.row_labels = [row_labels[i] for i in row_order]
+        if(col_labels is not None):
+            heatmap.col_labels = [col_labels[i] for i in col_order]
+        return heatmap
+
+    def append_rows(self, rows, row_labels=None, recluster=None):
+        """
+        Adds rows (an array with the same number of columns as heat_map_data, in the column order of the data that was
+        clustered, i.e. before the columns were reordered by the top dendrogram) to the plot without reclustering. Each
+        new row is placed in the row dendrogram next to its nearest row (by row_metric), see clustering.insert_leaf,
+        and the heat map, row labels and row colorbar are updated to the new leaf order. The next render_plot() only
+        redraws the parts that changed.
+
+        Every recluster_every appended rows (or when recluster=True) the rows are clustered again from scratch with
+        row_metric and row_method (and ordered by leaf_ordering) instead, since placing rows one at a time drifts from
+        what a full clustering gives.
+        Without a row dendrogram the rows are simply added at the bottom. row_labels is needed when the plot has row
+        labels.
+        """
+        rows = np.atleast_2d(np.asarray(rows))
+        data = self.heat_map_data
+        if(data is None):
+            raise ValueError('append_rows needs heat_map_data to append to')
+        if(not is_in_memory(data)):
+            raise TypeError('append_rows needs heat_map_data to be in memory, not a memory mapped or chunked array')
+        if(self.left_leaf_sizes is not None):
+            raise ValueError('append_rows cannot place rows in a collapsed row dendrogram (left_leaf_sizes is set)')
+        if(rows.ndim != 2 or rows.shape[1] != data.shape[1]):
+            raise ValueError('New rows must have %d columns, got shape %s' % (data.shape[1], rows.shape))
+        if(self.row_labels is not None and (row_labels is None or len(row_labels) != rows.shape[0])):
+            raise ValueError('The plot has row labels, so one label is needed for each new row')
+
+        if(self.top_dendrogram is not None):
+            #the columns of the plot are in the order of the top dendrogram's leaves
+            rows = rows[:, self.col_order]
+
+        n_old = data.shape[0]
+        n_rows = n_old + rows.shape[0]
+        rows = rows.astype(data.dtype, copy=False)
+        labels = None if self.row_labels is None else list(self.row_labels) + list(row_labels)
+        self.__appended_rows += rows.shape[0]
+        if(recluster is None):
+            recluster = self.recluster_every is not None and self.__appended_rows >= self.recluster_every
+
+        left_dendrogram = self.left_dendrogram
+        if(left_dendrogram is None):
+            order = np.arange(n_rows)
+        elif(recluster):
+            #clustered in display order, so the leaves index the old rows followed by the new ones directly
+            combined = np.concatenate([data, rows])
+            with self.__stage('clustering'):
+                left_dendrogram = linkage_matrix(combined, self.row_metric, self.row_method)
+            if(self.leaf_ordering == 'optimal'):
+                with self.__stage('leaf_ordering'):
+                    left_dendrogram = ordered_linkage(left_dendrogram, combined, self.row_metric, self.ordering_window)
+            del combined
+            order = leaf_order(left_dendrogram)
+            self.__appended_rows = 0
+        else:
+            with self.__stage('append_rows'):
+                leaves = self.row_order
+                #leaf ids of the existing rows are their positions in the original data, new rows are numbered after them
+                leaf_ids = np.concatenate([leaves, np.arange(n_old, n_rows)])
+                to_old = ssd.cdist(rows, data, self.row_metric)
+                to_new = ssd.cdist(rows, rows, self.row_metric)
+                for i in range(rows.shape[0]):
+                    #each row may also land next to a row appended before it
+                    distances = np.concatenate([to_old[i], to_new[i,:i]])
+                    nearest = int(np.argmin(distances))
+                    left_dendrogram = insert_leaf(left_dendrogram, leaf_ids[nearest], distances[nearest])
+                order = leaf_order(left_dendrogram).copy()
+                #map leaf ids back to positions in the old display order, followed by the new rows
+                rank = np.empty(n_old, dtype=int)
+                rank[leaves] = np.arange(n_old)
+                existing = order < n_old
+                order[existing] = rank[order[existing]]
+
+        #gathered straight from the old and new rows, so the data is copied once and keeps its dtype
+        self.heat_map_data = take_stacked_rows(data, rows, order)
+        if(labels is not None):
+            self.row_labels = [labels[i] for i in order]
+        if(left_dendrogram is not None):
+            self.left_dendrogram = left_dendrogram
+
+
+    #attributes that position the plot's axes, changing any of them means the figure is rebuilt from scratch
+    _layout_attributes = ('window_height', 'window_width', 'color_bar_width',
+                          'left_dendro_x', 'left_dendro_y', 'left_dendro_width', 'left_dendro_height',
+                          'top_dendro_x', 'top_dendro_y', 'top_dendro_width', 'top_dendro_height',
+                          'row_cb_x', 'row_cb_y', 'row_cb_width', 'row_cb_height',
+                          'col_cb_x', 'col_cb_y', 'col_cb_width', 'col_cb_height',
+                          'heat_x', 'heat_y', 'heat_width', 'heat_height',
+                          'color_legend_x', 'color_legend_y', 'color_legend_width', 'color_legend_height',
+                          'font_size')
+
+    #the order the components are drawn in, later components may depend on earlier ones
+    _components = ('top_dendrogram', 'left_dendrogram', 'heat_map', 'heat_map_style', 'labels', 'colorbars',
+                   'color_legend', 'title')
+
+    def render_plot(self,showFrames=False,dpi=None,figure=None):
+        """
+        Draws the plot into a new matplotlib.figure.Figure (with an Agg canvas) and stores it in self.figure. Pass an
+        empty figure to draw into that instead, e.g. one made by pyplot.figure(). No pyplot state is used otherwise,
+        so plots can be rendered from several threads or processes.
+
+        If the plot has already been rendered, only the parts whose data or settings changed since are redrawn (e.g.
+        changing the colormap only updates the heat map image and the color legend). Changing the position or size of
+        any part, or adding or removing one, rebuilds the whole figure. Call resetPlot() to force a full rebuild.
+        """
+        if(self.verbose):
+            print('Rendering plot...')
 
+        layout = self.__layoutState(showFrames)
+        if(figure is not None or self.figure is None or layout != self.__rendered.get('layout')):
+            self.resetPlot()
+            if(figure is None):
+                figure = mpl.figure.Figure(figsize=[self.window_width, self.window_height])
+                mpl.backends.backend_agg.FigureCanvasAgg(figure)
+            self.figure = figure
+            self.__rendered = {'layout':layout}
+            for attribute in self._render_attributes:
+                setattr(self, attribute, None)
+        self.__showFrames = showFrames
+        if(dpi is None):
+            dpi = self.figure.dpi
+
+        states = self.__componentStates(dpi)
+        for component in self._components:
+            if(states[component] != self.__rendered.get(component)):
+                if(self.verbose):
+                    print('Drawing %s...' % component)
+                with self.__stage(component):
+                    getattr(self, '_DendroHeatMap__draw_' + component)(dpi)
+                self.__rendered[component] = states[component]
+
+        if(self.heat_map_lod and self.heat_map_plot is not None):
+            self.__drawViewport(dpi)
 
-
-
-    def render_plot(self,showFrames=False):
-        self.resetPlot()
-        matplotlib.rcParams.update({"font.size":self.font_size})
+        self.plotRendered = True
 
         if(self.verbose):
-            print('Rendering plot...')
-
-        self.figure = pylab.figure(figsize=[self.window_width, self.window_height])
+            print( 'Plot rendered...')
 
-        #plot the top dendrogram
-        if(not self.top_dendrogram is None):
-            self.top_dendro_axes = self.figure.add_axes([self.top_dendro_x, self.top_dendro_y, self.top_dendro_width, self.top_dendro_height], frame_on=showFrames)
-            self.top_dendro_plot = sch.dendrogram(self.top_dendrogram)
-            self.top_dendro_axes.set_xticks([])
-            self.top_dendro_axes.set_yticks([])
-            self.top_dendro_axes.set_title(self.top_dendro_title)
-
-        #plot the left dendrogram
-        if(not self.left_dendrogram is None):
-            self.left_dendro_axes = self.figure.add_axes([self.left_dendro_x, self.left_dendro_y, self.left_dendro_width, self.left_dendro_height], frame_on=showFrames)
-            self.left_dendro_plot = sch.dendrogram(self.left_dendrogram,orientation='left')
-            self.left_dendro_axes.set_xticks([])
-            self.left_dendro_axes.set_yticks([])
-            self.left_dendro_axes.set_title(self.left_dendro_title,rotation='vertical')
-
-        #plot the heat map
-        if(not self.heat_map_data is None):
-            self.heat_map_axes = self.figure.add_axes([self.heat_x, self.heat_y, self.heat_width, self.heat_height], frame_on=showFrames)
-            self.heat_map_plot = self.heat_map_axes.matshow(self.heat_map_data, aspect='auto', origin='lower', cmap=self.colormap, norm=self.cmap_norm)
+    def __layoutState(self, showFrames):
+        return (tuple(getattr(self, attribute) for attribute in self._layout_attributes),
+                showFrames,
+                self.heat_map_data is None,
+                self.top_dendrogram is None,
+                self.left_dendrogram is None,
+                self.left_colorbar_labels is None)
+
+    def __componentStates(self, dpi):
+        #everything each component is drawn from, a component is redrawn when its state changes
+        norm = self.cmap_norm
+        norm_state = None if norm is None else (type(norm), norm.vmin, norm.vmax)
+        heat_map = (self.__versions['heat_map_data'], self.heat_map_aggregation, self.heat_map_lod, self.norm_scale, dpi)
+        return {'top_dendrogram':(self.__versions['top_dendrogram'], self.top_dendro_title),
+                'left_dendrogram':(self.__versions['left_dendrogram'], self.left_dendro_title),
+                'heat_map':heat_map,
+                'heat_map_style':(heat_map, self.colormap, norm_state),
+                'labels':(heat_map, _labels_state(self.row_labels), self.row_labels_size, self.max_row_labels,
+                          _labels_state(self.col_labels), self.col_labels_size, self.max_col_labels),
+                'colorbars':(heat_map, self.__versions['top_dendrogram'], self.__versions['left_dendrogram'],
+                             self.__versions['left_colorbar_labels'], self.__versions['top_colorbar_labels'], self.cluster_cb_colors,
+                             self.left_colorbar_legend_names),
+                'color_legend':(self.colormap, norm_state, self.color_legend_ticks, self.color_legend_title),
+                'title':(self.title,)}
+
+    def __draw_top_dendrogram(self, dpi):
+        if(self.top_dendrogram is None):
+            return
+        if(self.top_dendro_axes is None):
+            self.top_dendro_axes = self.figure.add_axes([self.top_dendro_x, self.top_dendro_y, self.top_dendro_width, self.top_dendro_height], frame_on=self.__showFrames)
+        else:
+            self.top_dendro_collection.remove()
+        self.top_dendro_plot = _layout_cache.get(self.top_dendrogram, stage=self.__stage)
+        self.top_dendro_collection = _draw_dendrogram(self.top_dendro_axes, self.top_dendro_plot, orientation='top')
+        self.top_dendro_axes.set_xticks([])
+        self.top_dendro_axes.set_yticks([])
+        self.top_dendro_axes.set_title(self.top_dendro_title, fontsize=_font_size('axes.titlesize', self.font_size))
+
+    def __draw_left_dendrogram(self, dpi):
+        if(self.left_dendrogram is None):
+            return
+        if(self.left_dendro_axes is None):
+            self.left_dendro_axes = self.figure.add_axes([self.left_dendro_x, self.left_dendro_y, self.left_dendro_width, self.left_dendro_height], frame_on=self.__showFrames)
+        else:
+            self.left_dendro_collection.remove()
+        self.left_dendro_plot = _layout_cache.get(self.left_dendrogram, stage=self.__stage)
+        self.left_dendro_collection = _draw_dendrogram(self.left_dendro_axes, self.left_dendro_plot, orientation='left',
+                                                       leaf_sizes=self.left_leaf_sizes)
+        self.left_dendro_axes.set_xticks([])
+        self.left_dendro_axes.set_yticks([])
+        self.left_dendro_axes.set_title(self.left_dendro_title,rotation='vertical',fontsize=_font_size('axes.titlesize', self.font_size))
+
+    def __draw_heat_map(self, dpi):
+        #when aggregating, the heat map and colorbars are reduced to at most one block per output pixel
+        #data that is not in memory is always aggregated, so it never has to be read in full
+        self.heat_map_row_starts = None
+        self.heat_map_col_starts = None
+        if(self.heat_map_data is None):
+            return
+        aggregation = self.heat_map_aggregation
+        if(aggregation is None and (self.heat_map_lod or not is_in_memory(self.heat_map_data))):
+            aggregation = 'mean'
+        if(aggregation and not self.heat_map_lod):
+            self.heat_map_row_starts = _block_starts(self.heat_map_data.shape[0], int(self.heat_height*self.window_height*dpi))
+            self.heat_map_col_starts = _block_starts(self.heat_map_data.shape[1], int(self.heat_width*self.window_width*dpi))
+
+        self.heat_map_rows = self.heat_map_data.shape[0]
+        self.heat_map_cols = self.heat_map_data.shape[1]
+        transform = self.__scaleTransform()
+        if(self.heat_map_lod):
+            #zooming swaps in the visible part of a level, see __drawViewport. Until then the coarsest level is shown
+            key = (self.__versions['heat_map_data'], aggregation, self.norm_scale)
+            if(self.__lod is None or self.__lod[0] != key):
+                with self.__stage('lod_pyramid'):
+                    self.__lod = (key, _lod_pyramid(self.heat_map_data, aggregation, transform))
+            self.__lod_view = None
+            levels = self.__lod[1]
+            self.heat_map_image = levels[-1] if levels else self.__readWindow(0, self.heat_map_rows, 0, self.heat_map_cols)
+        elif(self.heat_map_row_starts is None and self.heat_map_col_starts is None):
+            self.heat_map_image = np.asarray(self.heat_map_data)
+            if(transform is not None):
+                self.heat_map_image = transform(self.heat_map_image, np.arange(self.heat_map_rows))
+        else:
+            self.heat_map_image = _block_reduce_chunked(self.heat_map_data, self.heat_map_row_starts,
+                                                        self.heat_map_col_starts, aggregation, transform=transform)
+
+        #the extent keeps the axes in data coordinates even when the image has been reduced
+        extent = (-0.5, self.heat_map_cols-0.5, -0.5, self.heat_map_rows-0.5)
+        if(self.heat_map_axes is None):
+            self.heat_map_axes = self.figure.add_axes([self.heat_x, self.heat_y, self.heat_width, self.heat_height], frame_on=self.__showFrames)
+            self.heat_map_plot = self.heat_map_axes.matshow(self.heat_map_image, aspect='auto', origin='lower', cmap=get_colormap(self.colormap), norm=self.cmap_norm,
+                                                            extent=extent)
             self.heat_map_axes.set_xticks([])
             self.heat_map_axes.set_yticks([])
-            self.heat_map_rows = self.heat_map_data.shape[0]
-            self.heat_map_cols = self.heat_map_data.shape[1]
-
-            #add the from the labels to the figure
-            for i in range(0, self.heat_map_rows):
-                if(self.row_labels):
-                    if(len(self.row_labels) < self.max_row_labels):
-                        self.heat_map_axes.text(self.heat_map_cols-0.5, i-1/2, ' '+self.row_labels[i], size=self.row_labels_size)
-                        self.heat_map_axes.text(self.heat_map_cols-0.5, i-0.5, ' '+self.row_labels[i], size=self.row_labels_size)
-
+            self.heat_map_axes.format_coord = self.__formatCoords
+            self.heat_map_axes.callbacks.connect('xlim_changed', self.__limitsChanged)
+            self.heat_map_axes.callbacks.connect('ylim_changed', self.__limitsChanged)
+        else:
+            self.heat_map_axes.set_autoscale_on(True)
+            self.heat_map_plot.set_data(self.heat_map_image)
+            self.heat_map_plot.set_extent(extent)
+        if(self.heat_map_lod):
+            #the limits now follow the user's zooming only, not the extent of the part of the image being shown
+            self.heat_map_axes.set_autoscale_on(False)
+
+    def __readWindow(self, first_row, stop_row, first_col, stop_col):
+        #rows first_row..stop_row-1 and columns first_col..stop_col-1 of the heat map data as plotted
+        window = np.asarray(self.heat_map_data[first_row:stop_row, first_col:stop_col])
+        transform = self.__scaleTransform()
+        if(transform is not None):
+            window = transform(window, np.arange(first_row, stop_row), slice(first_col, stop_col))
+        return window
+
+    def __limitsChanged(self, axes):
+        if(self.heat_map_lod and self.heat_map_plot is not None):
+            self.__drawViewport()
+
+    def __drawViewport(self, dpi=None):
+        """
+        Level of detail mode: shows the visible part of the heat map from the coarsest level of the pyramid that still
+        has at least one block per pixel (full resolution when zoomed in far enough), and moves the dendrograms and
+        colorbars to the same rows and columns.
+        """
+        xlim = self.heat_map_axes.get_xlim()
+        ylim = self.heat_map_axes.get_ylim()
+        rows, cols = self.heat_map_rows, self.heat_map_cols
+        first_row = int(np.clip(np.floor(min(ylim) + 0.5), 0, rows - 1))
+        stop_row = int(np.clip(np.ceil(max(ylim) + 0.5), first_row + 1, rows))
+        first_col = int(np.clip(np.floor(min(xlim) + 0.5), 0, cols - 1))
+        stop_col = int(np.clip(np.ceil(max(xlim) + 0.5), first_col + 1, cols))
+
+        dpi = dpi or self.figure.dpi
+        pixel_rows = max(1.0, self.heat_height*self.window_height*dpi)
+        pixel_cols = max(1.0, self.heat_width*self.window_width*dpi)
+        blocks_per_pixel = min((stop_row - first_row)/pixel_rows, (stop_col - first_col)/pixel_cols)
+        levels = self.__lod[1]
+        level = int(np.clip(np.floor(np.log2(max(blocks_per_pixel, 1))), 0, len(levels)))
+        #a window much longer on one axis than the other could still be huge, so cap it at a few blocks per pixel
+        while(level < len(levels) and
+              (stop_row - first_row)*(stop_col - first_col)/4.0**level > _lod_max_blocks_per_pixel*pixel_rows*pixel_cols):
+            level += 1
+        size = 2**level
+        view = (level, first_row//size, -(-stop_row//size), first_col//size, -(-stop_col//size))
+        if(view != self.__lod_view):
+            self.__lod_view = view
+            level, first_block_row, stop_block_row, first_block_col, stop_block_col = view
+            if(level == 0):
+                self.heat_map_image = self.__readWindow(first_row, stop_row, first_col, stop_col)
+            else:
+                self.heat_map_image = levels[level-1][first_block_row:stop_block_row, first_block_col:stop_block_col]
+            self.heat_map_plot.set_data(self.heat_map_image)
+            self.heat_map_plot.set_extent((first_block_col*size - 0.5, min(stop_block_col*size, cols) - 0.5,
+                                           first_block_row*size - 0.5, min(stop_block_row*size, rows) - 0.5))
+
+        #leaf i of a dendrogram is drawn at 10*i + 5
+        if(self.top_dendro_axes is not None):
+            self.top_dendro_axes.set_xlim(10*(xlim[0] + 0.5), 10*(xlim[1] + 0.5))
+        if(self.left_dendro_axes is not None):
+            self.left_dendro_axes.set_ylim(10*(ylim[0] + 0.5), 10*(ylim[1] + 0.5))
+        if(self.col_cb_axes is not None):
+            self.col_cb_axes.set_xlim(xlim)
+        if(self.row_cb_axes is not None):
+            self.row_cb_axes.set_ylim(ylim)
+
+    def __draw_heat_map_style(self, dpi):
+        if(self.heat_map_plot is not None):
+            self.heat_map_plot.set_cmap(get_colormap(self.colormap))
+            self.heat_map_plot.set_norm(self.cmap_norm)
+
+    def __draw_labels(self, dpi):
+        if(self.heat_map_axes is not None):
+            self.__drawLabels()
+
+    def __draw_colorbars(self, dpi):
         #plot the column colorbar
         if(not self.top_dendrogram is None):
-            self.col_cb_axes = self.figure.add_axes([self.col_cb_x, self.col_cb_y, self.col_cb_width, self.col_cb_height], frame_on=True)
-            # print self.top_colorbar_labels.shape
-            # print 'Col cb'
-            # print [self.col_cb_x, self.col_cb_y, self.col_cb_width, self.col_cb_height]
-            self.col_cb_plot = self.col_cb_axes.matshow(self.top_colorbar_labels,aspect='auto',origin='lower',cmap=self.cluster_cb_colors)
+            if(self.col_cb_axes is None):
+                self.col_cb_axes = self.figure.add_axes([self.col_cb_x, self.col_cb_y, self.col_cb_width, self.col_cb_height], frame_on=True)
+            else:
+                self.col_cb_axes.cla()
+            self.col_cb_plot = self.__colorbarImage(self.col_cb_axes, self.top_colorbar_labels, col_starts=self.heat_map_col_starts,
+                                                  cmap=self.__clusterColormap())
             self.col_cb_axes.set_xticks([])
             self.col_cb_axes.set_yticks([])
 
-        #plot the row colorbar
-        if(not self.left_dendrogram is None):
-            self.row_cb_axes = self.figure.add_axes([self.row_cb_x, self.row_cb_y, self.row_cb_width, self.row_cb_height], frame_on=True)
-            # print self.left_colorbar_labels.shape
-            # print 'Row cb'
-            # print [self.row_cb_x, self.row_cb_y, self.row_cb_width, self.row_cb_height]
-            self.row_cb_plot = self.row_cb_axes.matshow(self.left_colorbar_labels, aspect='auto',origin='lower',cmap=self.cluster_cb_colors)
-            self.row_cb_axes.set_xticks([])
-            self.row_cb_axes.set_yticks([])
-
-        #plot the color legend
-        if(not self.heat_map_data is None):
-            self.color_legend_axes = self.figure.add_axes([self.color_legend_x, self.color_legend_y, self.color_legend_width, self.color_legend_height], frame_on=showFrames)
-            self.color_legend_plot = mpl.colorbar.ColorbarBase(self.color_legend_axes, cmap=self.colormap, norm=self.cmap_norm,orientation='horizontal')
-            tl=mpl.ticker.MaxNLocator(nbins=self.color_legend_ticks)
-            self.color_legend_plot.locator = tl
-            self.color_legend_plot.update_ticks()
-            self.color_legend_axes.set_title(self.color_legend_title)
-            self.heat_map_axes.format_coord = self.__formatCoords
-
-        #plot the row colorbar if its been set
-        if(not self.left_colorbar_labels is None and self.left_dendrogram is None):
-            #reset the colorbar
-            n_cb_classes = len(set(self.left_colorbar_labels[:, 0].tolist()))
-            self.cluster_cb_colors = mpl.colors.LinearSegmentedColormap.from_list(name="custom",
-                                                                                  colors=['r', 'g', 'b', 'y', 'w', 'k', 'm'],
-                                                                                  N=n_cb_classes)
-
-            self.row_cb_axes = self.figure.add_axes([self.row_cb_x, self.row_cb_y, self.row_cb_width, self.row_cb_height], frame_on=True)
-            self.row_cb_plot = self.row_cb_axes.matshow(self.left_colorbar_labels, aspect='auto',origin='lower',cmap=self.cluster_cb_colors)
+        #plot the row colorbar, from the left dendrogram or from left_colorbar_labels if they have been set without one
+        if(not self.left_colorbar_labels is None):
+            n_cb_classes = None
+            if(self.left_dendrogram is None):
+                n_cb_classes = len(np.unique(self.left_colorbar_labels[:, 0]))
+            if(self.row_cb_axes is None):
+                self.row_cb_axes = self.figure.add_axes([self.row_cb_x, self.row_cb_y, self.row_cb_width, self.row_cb_height], frame_on=True)
+            else:
+                self.row_cb_axes.cla()
+            self.row_cb_plot = self.__colorbarImage(self.row_cb_axes, self.left_colorbar_labels, row_starts=self.heat_map_row_starts,
+                                                  cmap=self.__clusterColormap(n_cb_classes))
             self.row_cb_axes.set_xticks([])
             self.row_cb_axes.set_yticks([])
-            self.row_cb_axes.legend(label=self.left_colorbar_legend_names)
-
-            # if(not self.left_colorbar_legend_names is None):
-            #     cbaxes = self.figure.add_axes([0.1, 0.1, 0.03, 0.8])
-            #     self.left_colorbar_legend = pylab.colorbar(self.row_cb_plot, cax=cbaxes)
-            #     self.left_colorbar_legend.set_label(self.left_colorbar_legend_names)
-
-        self.figure.suptitle(self.title)
-
-
-        self.plotRendered = True
+            if(self.left_dendrogram is None and self.left_colorbar_legend_names is not None):
+                #one patch per class, in the color the class has in the colorbar
+                classes = np.unique(self.left_colorbar_labels[:, 0])
+                colors = self.row_cb_plot.cmap(self.row_cb_plot.norm(classes))
+                handles = [mpl.patches.Patch(color=color) for color in colors]
+                self.row_cb_axes.legend(handles, self.left_colorbar_legend_names,
+                                        fontsize=_font_size('legend.fontsize', self.font_size))
+
+    def __draw_color_legend(self, dpi):
+        if(self.heat_map_data is None):
+            return
+        if(self.color_legend_axes is None):
+            self.color_legend_axes = self.figure.add_axes([self.color_legend_x, self.color_legend_y, self.color_legend_width, self.color_legend_height], frame_on=self.__showFrames)
+        else:
+            self.color_legend_axes.cla()
+        self.color_legend_plot = mpl.colorbar.ColorbarBase(self.color_legend_axes, cmap=get_colormap(self.colormap), norm=self.cmap_norm,orientation='horizontal')
+        tl=mpl.ticker.MaxNLocator(nbins=self.color_legend_ticks)
+        self.color_legend_plot.locator = tl
+        self.color_legend_plot.update_ticks()
+        self.color_legend_axes.tick_params(labelsize=_font_size('xtick.labelsize', self.font_size))
+        self.color_legend_axes.set_title(self.color_legend_title, fontsize=_font_size('axes.titlesize', self.font_size))
 
-        if(self.verbose):
-            print( 'Plot rendered...')
+    def __draw_title(self, dpi):
+        self.figure.suptitle(self.title, fontsize=_font_size('figure.titlesize', self.font_size))
 
 
     def show(self):
-        self.resetPlot()
-        self.render_plot()
-        pylab.show()
-
-    def export(self,filename):
-        self.resetPlot()
-        if('.' not in filename):
-            filename += '.png'
+        #only a figure made by pyplot, and not yet closed, can be shown again
+        if(self.figure is None or not pylab.fignum_exists(getattr(self.figure, 'number', None))):
+            self.resetPlot()
+            self.render_plot(figure=pylab.figure(figsize=[self.window_width, self.window_height]))
         else:
-            if(self.verbose):
-                print ('Saving plot to: ', filename)
             self.render_plot()
-            pylab.savefig(filename,dpi=self.exportDPI)
-
+        pylab.show()
 
+    def export(self,filename,format=None):
+        """
+        Saves the plot to filename, in the format its extension names. filename can also be a binary file object such
+        as io.BytesIO, written in format ('png' unless given).
+        """
+        if(not isinstance(filename, str)):
+            extension = (format or 'png').lower()
+        else:
+            if('.' not in filename):
+                filename += '.' + (format or 'png')
+            extension = (format or filename.rsplit('.', 1)[-1]).lower()
+        if(self.verbose):
+            print ('Saving plot to: ', filename)
+        key = None
+        if(self.render_cache is not None and isinstance(filename, str)):
+            with self.__stage('spec_hash'):
+                key = self.spec_hash()
+            if(self.render_cache.fetch(key, extension, filename)):
+                return
+        vector = self.vector_export and extension in _vector_formats
+        dpi = self.vector_dpi if vector else self.exportDPI
+        self.render_plot(dpi=dpi)
+        raster = self.raster_export and self.heat_map_plot is not None and extension in _raster_formats
+        if(raster):
+            context = self.__rasterHeatMap(dpi)
+        elif(vector):
+            context = self.__vectorParts(dpi)
+        else:
+            context = contextlib.nullcontext()
+        with context:
+            with self.__stage('savefig'):
+                self.figure.savefig(filename,dpi=dpi,format=extension)
+        if(key is not None):
+            self.render_cache.store(key, extension, filename)
+
+    async def render_async(self, dpi=None):
+        """
+        Awaitable render_plot(dpi=dpi), run on the bounded pool of the asynchronous module so the event loop is not
+        blocked. Cancelling the awaiting task stops the rendering at its next stage.
+        """
+        await self.__async(lambda: self.render_plot(dpi=dpi))
+
+    async def export_async(self, filename=None, format=None, keep_figure=False):
+        """
+        Awaitable export(). Without a filename the plot is returned as an io.BytesIO holding the exported file, in
+        format ('png' unless given). Unless
+        keep_figure is set, the figure is released afterwards, so only the plots being exported hold one in memory
+        (at most asynchronous.max_figures of them per event loop). Cancelling the awaiting task stops the export at
+        its next stage.
+        """
+        target = io.BytesIO() if filename is None else filename
+        def export():
+            try:
+                self.export(target, format=format)
+            finally:
+                if(not keep_figure):
+                    self.resetPlot()
+        await self.__async(export)
+        if(filename is None):
+            target.seek(0)
+            return target
+
+    async def __async(self, work):
+        #imported here so importing the package does not import asyncio
+        from . import asynchronous
+        cancel = threading.Event()
+        def job():
+            #one render or export of this plot at a time, they all draw into the same figure
+            with self.__lock:
+                if(cancel.is_set()):
+                    raise concurrent.futures.CancelledError()
+                self.__cancel = cancel
+                try:
+                    work()
+                finally:
+                    self.__cancel = None
+        await asynchronous.run(job, cancel)
+
+    #attributes besides the layout ones that change what is exported
+    _spec_attributes = ('colormap', 'exportDPI', 'raster_export', 'vector_export', 'vector_dpi', 'heat_map_aggregation', 'heat_map_lod', 'norm_scale',
+                        'left_dendro_x_distance_to_row_cb', 'left_dendro_y_distance_to_col_cb', 'row_cb_on', 'col_cb_on',
+                        'color_legend_ticks', 'row_labels', 'row_labels_size', 'max_row_labels',
+                        'col_labels', 'col_labels_size', 'max_col_labels', 'left_colorbar_labels', 'top_colorbar_labels',
+                        'left_leaf_sizes', 'left_colorbar_legend_names', 'cluster_cb_colors', 'left_dendro_title', 'top_dendro_title',
+                        'title', 'color_legend_title')
+
+    def spec(self):
+        """
+        Returns a canonical, JSON serializable description of everything an exported plot is drawn from: hashes of
+        the contents of heat_map_data and both dendrograms, every layout and style attribute (positions, sizes,
+        colormap, exportDPI, ...), the labels, titles and colorbar labels, the color normalization and the heat map's
+        limits if it has been zoomed or panned. Plots with equal specs export identical files. The hash of heat_map_data
+        is kept until the data is set again, so change the data through the setter rather than in place.
+        """
+        if(self.__data_digest is None or self.__data_digest[0] != self.__versions['heat_map_data']):
+            digest = None if self.heat_map_data is None else _data_digest(self.heat_map_data)
+            self.__data_digest = (self.__versions['heat_map_data'], digest)
+        norm = self.cmap_norm
+        spec = {'heat_map_data':self.__data_digest[1],
+                'top_dendrogram':_spec_value(self.top_dendrogram),
+                'left_dendrogram':_spec_value(self.left_dendrogram),
+                'norm':None if norm is None else [type(norm).__name__, _spec_value(norm.vmin), _spec_value(norm.vmax),
+                                                  _spec_value(getattr(norm, 'vcenter', None)), bool(norm.clip)]}
+        for attribute in self._layout_attributes + self._spec_attributes:
+            spec[attribute] = _spec_value(getattr(self, attribute))
+        spec['heat_map_view'] = self.__heatMapView()
+        return spec
+
+    def __heatMapView(self):
+        #the heat map's axes limits when zoomed or panned away from the whole matrix (e.g. in level of detail mode)
+        axes = getattr(self, 'heat_map_axes', None)
+        if(axes is None or self.heat_map_data is None):
+            return None
+        rows, cols = self.heat_map_data.shape[:2]
+        view = [float(limit) for limit in tuple(axes.get_xlim()) + tuple(axes.get_ylim())]
+        if(view == [-0.5, cols - 0.5, -0.5, rows - 0.5]):
+            return None
+        return view
+
+    def spec_hash(self):
+        #sha1 of spec(), the key export() looks plots up by in render_cache
+        return hashlib.sha1(json.dumps(self.spec(), sort_keys=True).encode('utf8')).hexdigest()
+
+    def export_heat_map(self, filename):
+        """
+        Saves just the heat map to a png file with one pixel per value of heat_map_data (row 0 at the bottom, as it is
+        plotted), in the current colormap and normalization. The data is read, colored and compressed one chunk of
+        rows at a time, so this works for matrices far too large to draw in a figure.
+        """
+        if(self.heat_map_data is None):
+            raise ValueError('There is no heat map data to export')
+        lut = colormap_lut(get_colormap(self.colormap))
+        rows, cols = self.heat_map_data.shape
+        with self.__stage('export_heat_map'):
+            write_png(filename, cols, rows, iter_colored_rows(self.heat_map_data, self.cmap_norm, lut,
+                                                              self.__scaleTransform()))
+
+    @contextlib.contextmanager
+    def __rasterHeatMap(self, dpi):
+        """
+        Swaps the heat map image for its pixels at dpi, colored through the colormap's lookup table with numpy and
+        drawn as they are, so savefig does not have to resample the image.
+        """
+        #the axes rarely start and end on whole pixels, Agg clips what is drawn in them to the nearest whole pixels
+        bounds = self.heat_map_axes.get_position().extents*np.tile(self.figure.get_size_inches()*dpi, 2)
+        left, right = np.floor(bounds[[0, 2]] + 0.5).astype(int)
+        bottom, top = np.ceil(bounds[[1, 3]] - 0.5).astype(int)
+        xlim = _rescale_limits(self.heat_map_axes.get_xlim(), bounds[0], bounds[2], left, right)
+        ylim = _rescale_limits(self.heat_map_axes.get_ylim(), bounds[1], bounds[3], bottom, top)
+        image = self.heat_map_image
+        if(not self.heat_map_lod and (image.shape[0] > top - bottom or image.shape[1] > right - left)):
+            #more values than pixels, reduce them as the aggregation does rather than skipping some
+            image = _block_reduce(image, _block_starts(image.shape[0], top - bottom),
+                                  _block_starts(image.shape[1], right - left), self.heat_map_aggregation or 'mean')
+        with self.__stage('raster_heat_map'):
+            pixels = render_pixels(image, self.heat_map_plot.get_extent(), xlim, ylim, right - left, top - bottom,
+                                   self.heat_map_plot.norm, colormap_lut(self.heat_map_plot.cmap))
+        #drawn above the axes, which would otherwise paint their background over it
+        body = self.figure.add_artist(pixel_artist(pixels, left, bottom, zorder=1))
+        self.heat_map_plot.set_visible(False)
+        try:
+            yield body
+        finally:
+            body.remove()
+            self.heat_map_plot.set_visible(True)
+
+
+
+    @contextlib.contextmanager
+    def __vectorParts(self, dpi):
+        """
+        Rasterizes the heat map and the colorbars at dpi, and swaps each dendrogram's LineCollection for one simplified
+        path per color in which links narrower than a pixel at dpi are merged (see _dendrogram_paths). The labels,
+        titles and color legend stay vectors. The heat map's pixels are made with numpy as for raster_export.
+        """
+        images = [image for image in (self.heat_map_plot, self.row_cb_plot, self.col_cb_plot) if image is not None]
+        width, height = self.figure.get_size_inches()
+        body = contextlib.ExitStack()
+        swapped = []
+        try:
+            for image in images:
+                image.set_rasterized(True)
+            if(self.heat_map_plot is not None and not self.heat_map_lod):
+                body.enter_context(self.__rasterHeatMap(dpi)).set_rasterized(True)
+            for axes, collection, linkage, orientation, leaf_sizes in (
+                    (self.top_dendro_axes, self.top_dendro_collection, self.top_dendrogram, 'top', None),
+                    (self.left_dendro_axes, self.left_dendro_collection, self.left_dendrogram, 'left', self.left_leaf_sizes)):
+                if(collection is None or linkage is None):
+                    continue
+                if(orientation == 'top'):
+                    limits, pixels = axes.get_xlim(), axes.get_position().width*width*dpi
+                else:
+                    limits, pixels = axes.get_ylim(), axes.get_position().height*height*dpi
+                with self.__stage('simplify_dendrogram'):
+                    paths = _dendrogram_paths(linkage, _layout_cache.get(linkage), orientation,
+                                              abs(limits[1] - limits[0])/max(pixels, 1), leaf_sizes)
+                #add_artist rather than add_patch, which would walk every vertex to update the data limits
+                patches = [axes.add_artist(mpl.patches.PathPatch(path, fill=False, edgecolor=color, joinstyle='round',
+                                                                 linewidth=collection.get_linewidth()[0]))
+                           for color, path in paths]
+                collection.set_visible(False)
+                swapped.append((collection, patches))
+            yield
+        finally:
+            body.close()
+            for image in images:
+                image.set_rasterized(False)
+            for collection, patches in swapped:
+                for patch in patches:
+                    patch.remove()
+                collection.set_visible(True)
+
+    @contextlib.contextmanager
+    def profiling(self, memory=True, callback=None):
+        """
+        Context manager that clears self.profile and records every stage run inside it. With memory=True, tracemalloc
+        is started (if it is not already tracing) and the peak bytes allocated during each stage are recorded too.
+        callback, if given, is used as profile_callback for the duration. Yields the profile dict.
+
+            with heatmap.profiling() as profile:
+                heatmap.export('plot.png')
+            print(profile['savefig']['seconds'])
+        """
+        self.profile.clear()
+        started = memory and not tracemalloc.is_tracing()
+        if(started):
+            tracemalloc.start()
+        previous = (self.profile_memory, self.profile_callback)
+        self.profile_memory = memory
+        if(callback is not None):
+            self.profile_callback = callback
+        try:
+            yield self.profile
+        finally:
+            self.profile_memory, self.profile_callback = previous
+            if(started):
+                tracemalloc.stop()
+
+    @contextlib.contextmanager
+    def __stage(self, name):
+        #times one stage of the work; with profile_memory set and tracemalloc tracing, also its peak allocation
+        if(self.__cancel is not None and self.__cancel.is_set()):
+            #stages are never left half done, so a cancelled plot can still be rendered or exported later
+            raise concurrent.futures.CancelledError(name)
+        tracing = self.profile_memory and tracemalloc.is_tracing()
+        if(tracing):
+            #stages nest, so hand the peak so far to the open stages before resetting it
+            peak = tracemalloc.get_traced_memory()[1]
+            for stage in self.__stages:
+                stage[1] = max(stage[1], peak)
+            tracemalloc.reset_peak()
+            stage = [tracemalloc.get_traced_memory()[0], 0]
+            self.__stages.append(stage)
+        start = time.time()
+        try:
+            yield
+        finally:
+            seconds = time.time() - start
+            allocated = None
+            if(tracing):
+                self.__stages.remove(stage)
+                allocated = max(stage[1], tracemalloc.get_traced_memory()[1]) - stage[0]
+            self.__record(name, seconds, allocated)
+
+    def __record(self, name, seconds, allocated):
+        entry = self.profile.setdefault(name, {'calls':0, 'seconds':0.0, 'bytes':None})
+        entry['calls'] += 1
+        entry['seconds'] += seconds
+        if(allocated is not None):
+            entry['bytes'] = max(entry['bytes'] or 0, allocated)
+        if(self.profile_callback is not None):
+            self.profile_callback(name, seconds, allocated)
 
     @property
     def heat_map_data(self):
@@ -282,22 +1396,113 @@ class DendroHeatMap(object):
 
     @heat_map_data.setter
     def heat_map_data(self, heat_map_data):
-        # print 'In the setter...'
-        self.__heat_map_data=heat_map_data
-        self.resetPlot()
-        # print type(heat_map_data)
-        if((isinstance(heat_map_data,np.ndarray)) | (isinstance(heat_map_data,np.matrix))):
-            hm_min = heat_map_data.min()
-            hm_max = heat_map_data.max()
-            self.cmap_norm = mpl.colors.Normalize(hm_min,hm_max)
+        #.npy files are memory mapped rather than loaded
+        if(isinstance(heat_map_data, str) and heat_map_data.endswith('.npy')):
+            heat_map_data = np.load(heat_map_data, mmap_mode='r')
+
+        if(heat_map_data is None):
+            self.__heat_map_data = None
+            self.__norm_stats = {}
+            self.cmap_norm = None
+            self.__versions['heat_map_data'] += 1
+        elif(is_array_like(heat_map_data)):
+            self.__heat_map_data=heat_map_data
+            self.__versions['heat_map_data'] += 1
+            #memory mapped and chunked arrays are scanned one chunk at a time
+            self.__norm_stats = {('range', None, None):min_max(heat_map_data)}
+            self.cmap_norm = None
         else:
-            raise TypeError('Data for the heatmap must be a numpy.ndarray or numpy.matrix object!')
+            raise TypeError('Data for the heatmap must be a numpy.ndarray, numpy.matrix, numpy.memmap, a path to a .npy '
+                            'file or a 2d chunked array (e.g. an h5py dataset)!')
 
 
+    @property
+    def cmap_norm(self):
+        """
+        The normalization of the heat map colors. Unless it has been set explicitly, it is built from the data using
+        norm_percentiles (a (low, high) pair of percentiles to clip the colors to, None for the full range),
+        norm_center (makes the colors symmetric around this value, e.g. 0 for diverging data) and norm_scale ('row' or
+        'col' to plot z-scores of each row or column). The statistics behind it are cached until heat_map_data changes.
+        """
+        if(self.__cmap_norm is not None or self.heat_map_data is None):
+            return self.__cmap_norm
+        low, high = self.__valueRange()
+        if(self.norm_center is not None):
+            radius = max(abs(high - self.norm_center), abs(self.norm_center - low))
+            low, high = self.norm_center - radius, self.norm_center + radius
+        return mpl.colors.Normalize(low, high)
+
+    @cmap_norm.setter
+    def cmap_norm(self, cmap_norm):
+        self.__cmap_norm = cmap_norm
+
+    def __valueRange(self):
+        #lowest and highest color values, cached per scaling and percentile setting
+        percentiles = None if self.norm_percentiles is None else tuple(self.norm_percentiles)
+        key = ('range', self.norm_scale, percentiles)
+        if(key not in self.__norm_stats):
+            transform = self.__scaleTransform()
+            if(percentiles is None):
+                self.__norm_stats[key] = min_max(self.heat_map_data, transform=transform)
+            else:
+                sample = sample_values(self.heat_map_data, _norm_sample_size, transform=transform)
+                self.__norm_stats[key] = tuple(np.percentile(sample, percentiles))
+        return self.__norm_stats[key]
+
+    def __scaleTransform(self):
+        #returns transform(block, rows, cols) turning blocks of rows (of columns cols, default all) into z-scores, or None
+        #when the data is plotted as is
+        if(self.norm_scale is None):
+            return None
+        if(self.norm_scale not in ('row', 'col')):
+            raise ValueError("norm_scale must be 'row', 'col' or None, got %r" % (self.norm_scale,))
+        key = ('moments', self.norm_scale)
+        if(key not in self.__norm_stats):
+            means, stds = moments(self.heat_map_data, axis=1 if self.norm_scale == 'row' else 0)
+            stds[stds == 0] = 1
+            self.__norm_stats[key] = (means, stds)
+        means, stds = self.__norm_stats[key]
+        dtype = np.result_type(self.heat_map_data.dtype, np.float32)
+
+        def transform(block, rows, cols=slice(None)):
+            block = np.asarray(block, dtype=dtype)
+            if(self.norm_scale == 'row'):
+                return (block - means[rows, None].astype(dtype))/stds[rows, None].astype(dtype)
+            return (block - means[cols].astype(dtype))/stds[cols].astype(dtype)
+        return transform
+
+    #attributes holding the rendered figure's artists, these are not pickled
+    _render_attributes = ('top_dendro_axes', 'top_dendro_plot', 'top_dendro_collection',
+                          'left_dendro_axes', 'left_dendro_plot', 'left_dendro_collection',
+                          'heat_map_axes', 'heat_map_plot', 'heat_map_image',
+                          'col_cb_axes', 'col_cb_plot', 'row_cb_axes', 'row_cb_plot',
+                          'color_legend_axes', 'color_legend_plot')
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for attribute in self._render_attributes:
+            state.pop(attribute, None)
+        state['_DendroHeatMap__figure'] = None
+        state['_DendroHeatMap__rendered'] = {}
+        state['_DendroHeatMap__lod'] = None
+        state['plotRendered'] = False
+        state['profile_callback'] = None
+        state['_DendroHeatMap__cancel'] = None
+        state['_DendroHeatMap__lock'] = None
+        state['_DendroHeatMap__stages'] = []
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.__lock = threading.Lock()
+
     def resetPlot(self):
         self.plotRendered = False
+        self.__rendered = {}
         if(self.figure):
-            pylab.close(self.figure)
+            #only figures made through pyplot need closing, and those can only exist once pyplot has been imported
+            if('matplotlib.pyplot' in sys.modules):
+                sys.modules['matplotlib.pyplot'].close(self.figure)
             self.figure = None
         else:
             self.figure = None
@@ -309,8 +1514,8 @@ class DendroHeatMap(object):
     @figure.setter
     def figure(self,figure):
         self.__figure = figure
-        if((not isinstance(figure, pylab.Figure)) & (isinstance(figure,object))):
-            #this force's the figure to either be "None" type or a pylab.Figure object
+        if((figure is not None) and (not isinstance(figure, mpl.figure.Figure))):
+            #this force's the figure to either be "None" type or a matplotlib.figure.Figure object
             self.__figure = None
 
 
@@ -320,8 +1525,8 @@ class DendroHeatMap(object):
 
     @row_labels.setter
     def row_labels(self, row_labels):
-        if(not isinstance(self.heat_map_data,np.ndarray) or not isinstance(self.heat_map_data, np.matrix)):
-            if(self.verbose):
+        if(self.heat_map_data is None or row_labels is None):
+            if(self.verbose and row_labels is not None):
                 print ("""Warning: data for heat map not yet specified, be sure that the number of elements in row_labels
                 is equal to the number of rows in heat_map_data.
                 """)
@@ -341,14 +1546,14 @@ class DendroHeatMap(object):
 
     @col_labels.setter
     def col_labels(self, col_labels):
-        if(not isinstance(self.heat_map_data,np.ndarray) or not isinstance(self.heat_map_data, np.matrix)):
-            if(self.verbose):
+        if(self.heat_map_data is None or col_labels is None):
+            if(self.verbose and col_labels is not None):
                 print ("""Warning: data for heat map not yet specified, be sure that the number of elements in col_labels
                 is equal to the number of columns in heat_map_data.
                 """)
             self.__col_labels = col_labels
         else:
-            if(len(col_labels) != self.heat_map_data.shape[0]):
+            if(len(col_labels) != self.heat_map_data.shape[1]):
                 print ("""Invalid entry for col_labels. Please be sure that the number of elements in col_labels is equal
                 to the number of columns in heat_map_data.""")
                 self.__col_labels = None
@@ -358,12 +1563,13 @@ class DendroHeatMap(object):
 
     @property
     def colormap(self):
+        if(self.__colormap is None):
+            return self.redBlackGreen
         return self.__colormap
 
     @colormap.setter
     def colormap(self, colormap):
         self.__colormap = colormap
-        self.resetPlot()
 
 
     @property
@@ -374,14 +1580,11 @@ class DendroHeatMap(object):
     def top_dendrogram(self,top_dendrogram):
         if(isinstance(top_dendrogram,np.ndarray)):
             self.__top_dendrogram = top_dendrogram
-            self.resetPlot()
-            self.top_colorbar_labels = np.array(sch.fcluster(top_dendrogram,0.7*max(top_dendrogram[:,2]),'distance'),dtype=int)
-            self.top_colorbar_labels.shape = (1,len(self.top_colorbar_labels))
-            temp_dendro = sch.dendrogram(top_dendrogram,no_plot=True)
-            self.top_colorbar_labels = self.top_colorbar_labels[:,temp_dendro['leaves']]
+            self.__versions['top_dendrogram'] += 1
+            self.top_colorbar_labels = self.__cutLabels(top_dendrogram, self.top_cut).reshape(1, -1)
         elif top_dendrogram is None:
             self.__top_dendrogram = top_dendrogram
-            self.resetPlot()
+            self.__versions['top_dendrogram'] += 1
         else:
             raise TypeError('Dendrograms must be a n-1 x 4 numpy.ndarray as per the scipy.cluster.hierarchy implementation!')
 
@@ -394,25 +1597,109 @@ class DendroHeatMap(object):
 
         if isinstance(left_dendrogram,np.ndarray):
             self.__left_dendrogram = left_dendrogram
-            self.resetPlot()
-            self.left_colorbar_labels = np.array(sch.fcluster(left_dendrogram,0.7 * max(left_dendrogram[:,2]),'distance'), dtype=int)
-            self.left_colorbar_labels.shape = (len(self.left_colorbar_labels),1)
-            temp_dendro = sch.dendrogram(left_dendrogram,no_plot=True)
-            self.left_colorbar_labels = self.left_colorbar_labels[temp_dendro['leaves'],:]
+            self.__versions['left_dendrogram'] += 1
+            if(self.left_leaf_sizes is not None and len(self.left_leaf_sizes) != left_dendrogram.shape[0] + 1):
+                self.__left_leaf_sizes = None
+            self.left_colorbar_labels = self.__cutLabels(left_dendrogram, self.left_cut, self.left_leaf_sizes)
         elif left_dendrogram is None:
+            self.__left_leaf_sizes = None
             self.__left_dendrogram = left_dendrogram
-            self.resetPlot()
+            self.__versions['left_dendrogram'] += 1
 
         else:
             raise TypeError('Dendrograms must be a n-1 x 4 numpy.ndarray as per the scipy.cluster.hierarchy implementation!')
 
 
+    @property
+    def row_order(self):
+        """
+        The order of the left dendrogram's leaves, i.e. the rows of the original data in the order they are plotted
+        (None without a left dendrogram). It is computed once per linkage and shared with the row colorbar.
+        """
+        return None if self.left_dendrogram is None else leaf_order(self.left_dendrogram)
+
+    @property
+    def col_order(self):
+        """
+        The order of the top dendrogram's leaves, see row_order.
+        """
+        return None if self.top_dendrogram is None else leaf_order(self.top_dendrogram)
+
+    @property
+    def left_cut(self):
+        """
+        Where the row dendrogram is cut into the clusters of the row colorbar: None for 0.7 times the highest merge,
+        a distance, or a (criterion, threshold) pair with criterion 'distance', 'maxclust' or 'inconsistent' as in
+        scipy.cluster.hierarchy.fcluster. Changing it only redraws the colorbar.
+        """
+        return self.__left_cut
+
+    @left_cut.setter
+    def left_cut(self, left_cut):
+        self.__left_cut = left_cut
+        if(self.left_dendrogram is not None):
+            self.left_colorbar_labels = self.__cutLabels(self.left_dendrogram, left_cut, self.left_leaf_sizes)
+
+    @property
+    def top_cut(self):
+        """
+        Where the column dendrogram is cut into the clusters of the column colorbar, see left_cut.
+        """
+        return self.__top_cut
+
+    @top_cut.setter
+    def top_cut(self, top_cut):
+        self.__top_cut = top_cut
+        if(self.top_dendrogram is not None):
+            self.top_colorbar_labels = self.__cutLabels(self.top_dendrogram, top_cut).reshape(1, -1)
+
+    @property
+    def top_colorbar_labels(self):
+        return self.__top_colorbar_labels
+
+    @top_colorbar_labels.setter
+    def top_colorbar_labels(self, top_colorbar_labels):
+        self.__versions['top_colorbar_labels'] += 1
+        self.__top_colorbar_labels = top_colorbar_labels
+
+    @property
+    def left_leaf_sizes(self):
+        """
+        For a collapsed left dendrogram, whose leaves are clusters of rows rather than single rows (see from_data's
+        row_clusters), the number of rows under each leaf, None otherwise. The rows of heat_map_data must be grouped
+        by leaf in the order the leaves are drawn. Each leaf is drawn as wide as its rows, and the row colorbar shows
+        the cluster of every row.
+        """
+        return self.__left_leaf_sizes
+
+    @left_leaf_sizes.setter
+    def left_leaf_sizes(self, left_leaf_sizes):
+        self.__left_leaf_sizes = None if left_leaf_sizes is None else np.asarray(left_leaf_sizes, dtype=int)
+        self.__versions['left_dendrogram'] += 1
+        if(self.left_dendrogram is not None):
+            self.left_colorbar_labels = self.__cutLabels(self.left_dendrogram, self.left_cut, self.__left_leaf_sizes)
+
+    def __cutLabels(self, linkage, cut, leaf_sizes=None):
+        #the flat cluster of each leaf, in the order the leaves are drawn, repeated for the rows of each leaf of a
+        #collapsed tree
+        layout = _layout_cache.get(linkage, stage=self.__stage)
+        if(cut is None):
+            clusters = layout['clusters']
+        else:
+            criterion, threshold = ('distance', cut) if np.isscalar(cut) else cut
+            with self.__stage('cluster_labels'):
+                clusters = layout['cuts'].labels(threshold, criterion)
+        if(leaf_sizes is None):
+            return clusters[layout['leaves']]
+        return np.repeat(clusters[layout['leaves']], leaf_sizes[layout['leaves']])
+
     @property
     def left_colorbar_labels(self):
         return self._left_colorbar_labels
 
     @left_colorbar_labels.setter
     def left_colorbar_labels(self, left_colorbar_labels):
+        self.__versions['left_colorbar_labels'] += 1
         if isinstance(left_colorbar_labels, list):
             self._left_colorbar_labels = np.array(left_colorbar_labels)
             self._left_colorbar_labels.shape = (len(self._left_colorbar_labels), 1)
@@ -431,79 +1718,72 @@ class DendroHeatMap(object):
 
 
 
-    def __RedBlackSkyBlue(self):
-        cdict = {'red':   ((0.0, 0.0, 0.0),
-                           (0.5, 0.0, 0.1),
-                           (1.0, 1.0, 1.0)),
-
-                 'green': ((0.0, 0.0, 0.9),
-                           (0.5, 0.1, 0.0),
-                           (1.0, 0.0, 0.0)),
-
-                 'blue':  ((0.0, 0.0, 1.0),
-                           (0.5, 0.1, 0.0),
-                           (1.0, 0.0, 0.0))
-                }
-
-        my_cmap = mpl.colors.LinearSegmentedColormap('my_colormap',cdict,256)
-        return my_cmap
-
-    def __RedBlackBlue(self):
-        cdict = {'red':   ((0.0, 0.0, 0.0),
-                           (0.5, 0.0, 0.1),
-                           (1.0, 1.0, 1.0)),
-
-                 'green': ((0.0, 0.0, 0.0),
-                           (1.0, 0.0, 0.0)),
-
-                 'blue':  ((0.0, 0.0, 1.0),
-                           (0.5, 0.1, 0.0),
-                           (1.0, 0.0, 0.0))
-                }
-
-        my_cmap = mpl.colors.LinearSegmentedColormap('my_colormap',cdict,256)
-        return my_cmap
-
-
-    def __RedBlackGreen(self):
-        cdict = {'red':   ((0.0, 0.0, 0.0),
-                           (0.5, 0.0, 0.1),
-                           (1.0, 1.0, 1.0)),
-
-                 'blue': ((0.0, 0.0, 0.0),
-                           (1.0, 0.0, 0.0)),
-
-                 'green':  ((0.0, 0.0, 1.0),
-                           (0.5, 0.1, 0.0),
-                           (1.0, 0.0, 0.0))
-                }
-
-        my_cmap = mpl.colors.LinearSegmentedColormap('my_colormap',cdict,256)
-        return my_cmap
-
-    def __YellowBlackBlue(self):
-        cdict = {'red':   ((0.0, 0.0, 0.0),
-                           (0.5, 0.0, 0.1),
-                           (1.0, 1.0, 1.0)),
-
-                 'green': ((0.0, 0.0, 0.8),
-                           (0.5, 0.1, 0.0),
-                           (1.0, 1.0, 1.0)),
-
-                 'blue':  ((0.0, 0.0, 1.0),
-                           (0.5, 0.1, 0.0),
-                           (1.0, 0.0, 0.0))
-                }
-        ### yellow is created by adding y = 1 to RedBlackSkyBlue green last tuple
-        ### modulate between blue and cyan using the last y var in the first green tuple
-        my_cmap = mpl.colors.LinearSegmentedColormap('my_colormap',cdict,256)
-        return my_cmap
+    @property
+    def cluster_cb_colors(self):
+        return self.__cluster_cb_colors
+
+    @cluster_cb_colors.setter
+    def cluster_cb_colors(self, cluster_cb_colors):
+        #a colormap or its name, None picks the shared cluster colormap for the number of classes shown
+        self.__cluster_cb_colors = cluster_cb_colors
+
+    #the colormaps live in the shared registry of the colormaps module, instances only refer to them by name
+    redBlackBlue = 'redBlackBlue'
+    redBlackSkyBlue = 'redBlackSkyBlue'
+    redBlackGreen = 'redBlackGreen'
+    yellowBlackBlue = 'yellowBlackBlue'
+
+    def __clusterColormap(self, n_classes=None):
+        if(self.cluster_cb_colors is not None):
+            return get_colormap(self.cluster_cb_colors)
+        return cluster_colormap(n_classes)
+
+    def __drawLabels(self):
+        #each axis gets one batch of tick labels, thinned to what fits at the current figure size and dpi
+        dpi = self.figure.dpi
+        self.heat_map_axes.set_xticks([])
+        self.heat_map_axes.set_yticks([])
+        if(self.row_labels is not None and len(self.row_labels)):
+            rows = _label_positions(len(self.row_labels), self.heat_height*self.window_height, dpi,
+                                    self.row_labels_size, self.max_row_labels)
+            self.heat_map_axes.yaxis.set_ticks_position('right')
+            self.heat_map_axes.set_yticks(rows)
+            self.heat_map_axes.set_yticklabels(np.asarray(self.row_labels, dtype=object)[rows], size=self.row_labels_size)
+
+        if(self.col_labels is not None and len(self.col_labels)):
+            cols = _label_positions(len(self.col_labels), self.heat_width*self.window_width, dpi,
+                                    self.col_labels_size, self.max_col_labels)
+            self.heat_map_axes.xaxis.set_ticks_position('bottom')
+            self.heat_map_axes.set_xticks(cols)
+            self.heat_map_axes.set_xticklabels(np.asarray(self.col_labels, dtype=object)[cols], size=self.col_labels_size,
+                                               rotation='vertical')
+
+        self.heat_map_axes.tick_params(length=0)
+
+    def __colorbarImage(self, axes, labels, row_starts=None, col_starts=None, cmap=None):
+        #colorbars follow the heat map's block grid, each block shows the label of its first leaf
+        rows, cols = labels.shape
+        if(row_starts is not None):
+            labels = labels[row_starts,:]
+        if(col_starts is not None):
+            labels = labels[:,col_starts]
+        return axes.matshow(labels, aspect='auto', origin='lower', cmap=cmap,
+                            extent=(-0.5, cols-0.5, -0.5, rows-0.5))
 
     def __formatCoords(self, x,y):
         col = int(x+0.5)
         row = int(y+0.5)
         if col>=0 and col<self.heat_map_cols and row>=0 and row<self.heat_map_rows:
-            z = self.heat_map_data[row,col]
+            if(self.heat_map_lod):
+                #the image only covers the visible window, so read the full resolution value instead
+                z = self.__readWindow(row, row+1, col, col+1)[0,0]
+                return 'x=%1.4f, y=%1.4f, z=%1.4f'%(x, y, z)
+            #report the value that is actually displayed at this position
+            if(self.heat_map_row_starts is not None):
+                row = np.searchsorted(self.heat_map_row_starts, row, side='right') - 1
+            if(self.heat_map_col_starts is not None):
+                col = np.searchsorted(self.heat_map_col_starts, col, side='right') - 1
+            z = self.heat_map_image[row,col]
             return 'x=%1.4f, y=%1.4f, z=%1.4f'%(x, y, z)
         else:
             return 'x=%1.4f, y=%1.4f'%(x, y)
@@ -0,0 +1,185 @@
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2015 Matthew Antalek Jr
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import struct
+import zlib
+import numpy as np
+from .chunked import chunk_rows
+from ._lazy import LazyModule
+
+matplotlib = mpl = LazyModule('matplotlib', submodules=('artist',))
+
+
+#zlib level used for the png files written here, the same as matplotlib uses
+_png_compression = 6
+
+#roughly how many pixels are colored at a time
+_chunk_pixels = 2**22
+
+
+def colormap_lut(cmap):
+    """
+    Returns the colormap's lookup table as a (N+3) x 4 array of bytes, in the order matplotlib uses: the N colors,
+    then the under, over and bad colors.
+    """
+    n = cmap.N
+    return np.concatenate([cmap(np.arange(n), bytes=True), cmap(np.array([-1]), bytes=True),
+                           cmap(np.array([n]), bytes=True), cmap(np.array([np.nan]), bytes=True)])
+
+
+def lut_indices(normed, n_colors):
+    #the rows of the lookup table that matplotlib's Colormap.__call__ picks for normalized values
+    bad = np.ma.getmaskarray(normed) if np.ma.is_masked(normed) else None
+    indices = np.array(np.ma.getdata(normed), copy=True)
+    if(indices.dtype.kind == 'f'):
+        indices *= n_colors
+        indices[indices == n_colors] = n_colors - 1
+    under = indices < 0
+    over = indices >= n_colors
+    if(bad is None):
+        bad = np.isnan(indices)
+    with np.errstate(invalid='ignore'):
+        indices = indices.astype(np.intp)
+    indices[under] = n_colors
+    indices[over] = n_colors + 1
+    indices[bad] = n_colors + 2
+    return indices
+
+
+def colorize(values, norm, lut):
+    """
+    Maps values through norm and a lookup table from colormap_lut, to the same bytes cmap(norm(values), bytes=True)
+    gives.
+    """
+    return lut.take(lut_indices(norm(values), len(lut) - 3), axis=0, mode='clip')
+
+
+def _sample_positions(n_pixels, limits, extent, n_values):
+    #for the center of each of n_pixels spanning limits, the index of the value of an image axis of n_values
+    #spanning extent that is drawn there (nearest neighbour), -1 where the image does not reach
+    centers = limits[0] + (np.arange(n_pixels) + 0.5)*(limits[1] - limits[0])/float(n_pixels)
+    positions = np.floor((centers - extent[0])/(extent[1] - extent[0])*n_values).astype(np.intp)
+    positions[(positions < 0) | (positions >= n_values)] = -1
+    return positions
+
+
+def render_pixels(image, extent, xlim, ylim, width, height, norm, lut):
+    """
+    Renders image, drawn with extent (left, right, bottom, top) and origin='lower' in axes with the given limits, to
+    a height x width x 4 array of bytes (bottom row first) using nearest neighbour sampling. Pixels the image does
+    not cover are transparent. Each value is colored once, so the work scales with the image and the output size,
+    not with their product.
+    """
+    rows = _sample_positions(height, ylim, extent[2:], image.shape[0])
+    cols = _sample_positions(width, xlim, extent[:2], image.shape[1])
+    out = np.zeros((height, width, 4), dtype=np.uint8)
+    inside_rows = np.flatnonzero(rows >= 0)
+    inside_cols = np.flatnonzero(cols >= 0)
+    if(len(inside_rows) == 0 or len(inside_cols) == 0):
+        return out
+    #the image covers one unbroken range of pixels on each axis, so each of its rows is stretched to the output width
+    #once and then copied into every pixel row it covers
+    first_row, stop_row = inside_rows[0], inside_rows[-1] + 1
+    first_col, stop_col = inside_cols[0], inside_cols[-1] + 1
+    stretched = colorize(np.asarray(image), norm, lut).take(cols[first_col:stop_col], axis=1)
+    step = max(1, _chunk_pixels//(stop_col - first_col))
+    for start in range(first_row, stop_row, step):
+        stop = min(start + step, stop_row)
+        out[start:stop, first_col:stop_col] = stretched.take(rows[start:stop], axis=0)
+    return out
+
+
+_PixelArtist = None
+
+
+def pixel_artist(pixels, left, bottom, zorder=1):
+    """
+    Returns an artist drawing pixels (a height x width x 4 array of bytes, bottom row first) with its bottom left
+    corner at pixel (left, bottom) of the canvas. Unlike Figure.figimage nothing is resampled on the way, so it only
+    suits raster output at the dpi the pixels were made for, or vector output with the artist rasterized at that dpi.
+    """
+    global _PixelArtist
+    if(_PixelArtist is None):
+        class PixelArtist(mpl.artist.Artist):
+            def __init__(self, pixels, left, bottom):
+                mpl.artist.Artist.__init__(self)
+                self.pixels = pixels
+                self.left = left
+                self.bottom = bottom
+
+            #when rasterized in vector output, the pixels go through an Agg renderer at the dpi they were made for
+            @mpl.artist.allow_rasterization
+            def draw(self, renderer):
+                if(not self.get_visible()):
+                    return
+                gc = renderer.new_gc()
+                renderer.draw_image(gc, self.left, self.bottom, self.pixels)
+                gc.restore()
+        _PixelArtist = PixelArtist
+    artist = _PixelArtist(pixels, left, bottom)
+    artist.set_zorder(zorder)
+    return artist
+
+
+def _png_chunk(kind, data):
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+
+
+def write_png(filename, width, height, blocks):
+    """
+    Writes an 8 bit RGBA png of width x height pixels, where blocks yields arrays of k x width x 4 bytes from the top
+    row down. The rows are compressed as they come, so the whole image is never held in memory.
+    """
+    compressor = zlib.compressobj(_png_compression)
+    written = 0
+    with open(filename, 'wb') as png:
+        png.write(b'\x89PNG\r\n\x1a\n')
+        png.write(_png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0)))
+        for block in blocks:
+            block = np.ascontiguousarray(block, dtype=np.uint8).reshape(-1, width*4)
+            #each row starts with its filter type, 0 for none
+            scanlines = np.empty((block.shape[0], width*4 + 1), dtype=np.uint8)
+            scanlines[:,0] = 0
+            scanlines[:,1:] = block
+            written += block.shape[0]
+            compressed = compressor.compress(scanlines.tobytes())
+            if(compressed):
+                png.write(_png_chunk(b'IDAT', compressed))
+        png.write(_png_chunk(b'IDAT', compressor.flush()))
+        png.write(_png_chunk(b'IEND', b''))
+    if(written != height):
+        raise ValueError('Expected %d rows of pixels for the png, got %d' % (height, written))
+
+
+def iter_colored_rows(data, norm, lut, transform=None):
+    """
+    Yields blocks of data colored one value per pixel, from the last row up (so that row 0 ends up at the bottom as
+    with origin='lower'), reading data one chunk of rows at a time. transform(block, rows) is applied first.
+    """
+    rows = max(1, min(chunk_rows(data), _chunk_pixels//max(1, data.shape[1])))
+    for stop in range(data.shape[0], 0, -rows):
+        start = max(0, stop - rows)
+        block = np.asarray(data[start:stop])
+        if(transform is not None):
+            block = transform(block, np.arange(start, stop))
+        yield colorize(block, norm, lut)[::-1]